@@ -4,22 +4,30 @@ import os
 import pandas as pd
 import plotly.express as px
 import streamlit.components.v1 as components
+import threading
 import time
-import pickle
 from typing import List, Tuple
 from dataclasses import dataclass
 from mongo import WarOpMongoDB
 from corpus import CorpusManager
 from gensimLDA import GensimLDA
+from enrichment import backfill_enrichment
+from artifacts import ARTIFACTS_DIR, current_version_dir, load_artifacts, load_graph, publish_artifacts
 from vaderSentimentAnalysis import VaderSentimentAnalyzer
 from graph import Graph
-from shared_state import get_state_version, load_state
+from cooccurrence import CooccurrenceMatrix
+from render_cache import GraphRenderCache
+from shared_state import get_state_version, load_state, wait_for_version
 from dataStructures import PostDataStructure, EnhancedPostDataStructure
 import pathlib
 
 # Constants
 UPDATE_INTERVAL = 10 * 60  # seconds
+TOKENIZER_PROCESSES = os.cpu_count()  # Worker processes used to tokenize and score the whole archive
 CACHE_KEY = "war_op_data"
+PAGE_SIZE = 20  # Post cards per page
+SENTIMENT_LABELS = ["Positive", "Neutral", "Negative"]
+READ_ONLY = True  # Serve the versions the consumer publishes instead of rebuilding everything on each one
 
 @dataclass
 class SessionState:
@@ -32,20 +40,59 @@ class SessionState:
 
 @st.cache_resource
 def initialize_session(use_saved_model=False) -> SessionState:
-    get_cached_graph_html.clear()  # Clear the graph HTML cache
-    graph = Graph()
-    _, lda, corpus_manager, db = process_data(use_saved_model)
+    graph, lda, corpus_manager, db = process_data(use_saved_model)
+    return SessionState(graph, lda, corpus_manager, db)
 
-    # Create the initial graph
-    tokenized_texts = corpus_manager.get_tokenized_texts()
-    graph.create_network_graph(tokenized_texts, min_weight=100)
+class PublishedSession:
+    def __init__(self):
+        """
+        Session of the latest version published by the consumer. A background thread loads each new
+        version off the request path and swaps it in with a single assignment, so reruns always see a
+        complete session.
+        """
+        self.session = load_published_session()
+        threading.Thread(target=self._watch, daemon=True).start()
 
-    return SessionState(graph, lda, corpus_manager, db)
+    def _watch(self):
+        while True:
+            wait_for_version(self.session.version + 1)
+            try:
+                self.session = load_published_session()
+            except Exception as e:
+                print(f"⚠ Error loading the published version: {e}")
+                time.sleep(10)  # Retry; the version may have been pruned by a newer one
+
+def load_published_session() -> SessionState:
+    """
+    Loads only the model and graph of the published version; posts and aggregates are read from Mongo.
+    The session gets a CorpusManager of its own, so loading it never changes the one still being served.
+    """
+    # The artifacts published with the version, from the same read of the state so the two always match
+    state = load_state()
+    version = state.get('version', 0)
+    version_dir = os.path.join(ARTIFACTS_DIR, state['artifacts']) if state.get('artifacts') else None
+    if version_dir is None or not os.path.isdir(version_dir):
+        version_dir = current_version_dir()  # Published without a version bump, or pruned since
+    lda, corpus_manager = load_artifacts(version_dir=version_dir, standalone=True)
+    graph = load_published_graph(version_dir, corpus_manager)
+    return SessionState(graph, lda, corpus_manager, WarOpMongoDB(), last_update=time.time(), version=version)
+
+def load_published_graph(version_dir, corpus_manager: CorpusManager) -> Graph:
+    """ Loads the graph published with a version, building it from the corpus if it was published without one. """
+    graph = load_graph(version_dir)
+    if graph is None:
+        cooccurrences = CooccurrenceMatrix().add_documents(corpus_manager.get_tokenized_texts())
+        graph = Graph.from_cooccurrences(cooccurrences, min_weight=100)
+    return graph
 
-@st.cache_data
-def get_cached_graph_html(nodes, edges, node_sizes, min_weight=10, n_components=None):
-    graph = Graph.from_graph_data({'nodes': nodes, 'edges': edges, 'node_sizes': node_sizes})
-    return graph.prune_graph(min_weight).draw_graph_pyvis(n_components=n_components)
+@st.cache_resource
+def get_published_session() -> PublishedSession:
+    return PublishedSession()
+
+@st.cache_resource
+def get_render_cache() -> GraphRenderCache:
+    """ Rendered graph HTML shared by every session, keyed by graph version and slider positions. """
+    return GraphRenderCache()
 
 def check_for_updates(session_state: SessionState) -> bool:
     current_version = get_state_version()
@@ -55,47 +102,26 @@ def check_for_updates(session_state: SessionState) -> bool:
 
 def process_data(use_saved_model=False) -> Tuple[Graph, GensimLDA, CorpusManager, WarOpMongoDB]:
     db = WarOpMongoDB()
+    db.refreshEnhancedPosts()  # Pick up posts the consumer saved since the last load
     corpus_manager = CorpusManager()
     lda = GensimLDA(corpus_manager)
-    sentiment_analyzer = VaderSentimentAnalyzer(corpus_manager)
+    sentiment_analyzer = VaderSentimentAnalyzer(corpus_manager, processes=TOKENIZER_PROCESSES)
 
-    all_db_posts: List[PostDataStructure] = db.findAllPosts()
-    corpus_manager.update_corpus(all_db_posts)
-
-    if use_saved_model == True and os.path.isfile('trained_lda_model.pkl'):
-        with open('trained_lda_model.pkl', 'rb') as f:
-            lda, corpus_manager = pickle.load(f)
+    if use_saved_model == True and current_version_dir() is not None:
+        # Only the model and dictionary are read; the model arrays are shared with the consumer via mmap
+        version_dir = current_version_dir()
+        lda, corpus_manager = load_artifacts(version_dir=version_dir)
+        graph = load_published_graph(version_dir, corpus_manager)
     else:
+        all_db_posts: List[PostDataStructure] = db.findAllPosts()
+        corpus_manager.update_corpus(all_db_posts, processes=TOKENIZER_PROCESSES)
         lda.train_gensim()
-    
-        with open('trained_lda_model.pkl', 'wb') as f:
-            pickle.dump((lda, corpus_manager), f)
-    
-    graph = Graph()
-    graph.create_network_graph(corpus_manager.get_tokenized_texts(), min_weight=100)
+        cooccurrences = CooccurrenceMatrix().add_documents(corpus_manager.get_tokenized_texts())
+        graph = Graph.from_cooccurrences(cooccurrences, min_weight=100)
+        publish_artifacts(lda, corpus_manager, graph=graph)
 
-    for post in all_db_posts:
-        topic = lda.predict_topic(article=post.selftext)
-        sentiment, sentiment_probs = sentiment_analyzer.analyze_sentiment(post.selftext)
-        overall_sentiment, overall_sentiment_probs = sentiment_analyzer.analyze_overall_post_sentiment(post.selftext, post.comments, ratio=0.7)
-        
-        enhanced_post = EnhancedPostDataStructure(
-            id=post.id,
-            title=post.title,
-            upvote_ratio=post.upvote_ratio,
-            author=post.author,
-            created_utc=post.created_utc,
-            score=post.score,
-            url=post.url,
-            selftext=post.selftext,
-            num_comments=post.num_comments,
-            comments=post.comments,
-            sentiment_score={"label": sentiment, "probs": sentiment_probs},
-            overall_sentiment_score={"label": overall_sentiment, "probs": overall_sentiment_probs},
-            topic=topic
-        )
-
-        db.saveEnhancedPost(enhanced_post)
+    # Only posts whose content or model version changed since they were enriched are scored again
+    backfill_enrichment(db, lda, sentiment_analyzer)
 
     return graph, lda, corpus_manager, db
 
@@ -112,38 +138,83 @@ def render_post_card(post: EnhancedPostDataStructure):
         st.write(f"**Text** {post.selftext}")
     st.html('</div>')
 
-def render_post_cards(posts: List[EnhancedPostDataStructure]):
+def render_post_cards(db: WarOpMongoDB, lda: GensimLDA):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sentiment = st.selectbox("Sentiment", ["All"] + SENTIMENT_LABELS)
+    with col2:
+        topic = st.selectbox("Topic", ["All"] + list(range(lda.num_topics)))
+    with col3:
+        dates = st.date_input("Date range", value=())
+
+    filters = {
+        "sentiment": None if sentiment == "All" else sentiment,
+        "topic_id": None if topic == "All" else topic,
+        "date_from": f"{dates[0]:%Y-%m-%d} 00:00:00" if len(dates) > 0 else None,
+        "date_to": f"{dates[-1]:%Y-%m-%d} 23:59:59" if len(dates) > 0 else None,
+    }
+
+    # Cursors of the pages visited so far, reset whenever the filters change
+    if st.session_state.get("post_cards_filters") != filters:
+        st.session_state["post_cards_filters"] = filters
+        st.session_state["post_cards_cursors"] = [None]
+    cursors = st.session_state["post_cards_cursors"]
+
+    posts, next_cursor = db.findEnhancedPostsPage(limit=PAGE_SIZE, after=cursors[-1], **filters)
+
     col1, col2 = st.columns(2)
     for i, post in enumerate(posts):
         with col1 if i % 2 == 0 else col2:
             render_post_card(post)
 
+    previous_col, page_col, next_col = st.columns([1, 2, 1])
+    with previous_col:
+        if st.button("⬅ Previous", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with page_col:
+        st.write(f"Page {len(cursors)}")
+    with next_col:
+        if st.button("Next ➡", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+
 def render_topic_distribution(db: WarOpMongoDB, lda: GensimLDA):
-    enhanced_posts = db.getAllEnhancedPost()
-    topic_counts = {}
-    for post in enhanced_posts:
-        topic_id = post.topic['topic_id']
-        topic_counts[topic_id] = topic_counts.get(topic_id, 0) + 1
-    
+    # Counts are maintained as posts are saved; seed them from the posts the first time
+    aggregates = db.getAggregates()
+    if not aggregates['topics']:
+        aggregates = db.rebuildAggregates()
+    topic_counts = dict(sorted(aggregates['topics'].items()))
+
     df = pd.DataFrame(list(topic_counts.items()), columns=['Topic', 'Count'])
     fig = px.bar(df, x='Topic', y='Count', title='Number of Documents per Topic')
     st.plotly_chart(fig)
-    
+
+    df = pd.DataFrame([(topic_id, label, count) for (topic_id, label), count in aggregates['topic_sentiments'].items()],
+                      columns=['Topic', 'Sentiment', 'Count'])
+    fig = px.bar(df, x='Topic', y='Count', color='Sentiment', title='Sentiment per Topic')
+    st.plotly_chart(fig)
+
     st.subheader("Top Keywords per Topic")
     for topic_id in topic_counts.keys():
-        keywords = lda.get_topic_keywords(topic_id)
+        # The model's own keywords match the topics it numbers; the stored ones lag behind until posts are re-enriched
+        keywords = lda.topic_keywords.get(topic_id) or aggregates['keywords'].get(topic_id, [])
         st.write(f"**Topic {topic_id}:** {', '.join(keywords)}")
 
 def main():
     st.set_page_config(page_title="War Operation Mining Dashboard", layout="wide")
 
-    if CACHE_KEY not in st.session_state:
+    if READ_ONLY and current_version_dir() is not None:
+        # Versions are swapped in by a background thread, nothing is rebuilt on the request path
+        session_state = get_published_session().session
+    elif CACHE_KEY not in st.session_state:
         st.session_state[CACHE_KEY] = initialize_session(use_saved_model=True)
-
-    session_state = st.session_state[CACHE_KEY]
+        session_state = st.session_state[CACHE_KEY]
+    else:
+        session_state = st.session_state[CACHE_KEY]
     
     # Check for updates
-    if check_for_updates(session_state):
+    if not READ_ONLY and check_for_updates(session_state):
         st.cache_resource.clear()
         st.cache_data.clear()
         session_state = initialize_session(use_saved_model=True)
@@ -151,6 +222,8 @@ def main():
         st.session_state[CACHE_KEY] = session_state
         st.rerun()
 
+    get_render_cache().publish(session_state.graph, session_state.version)
+
     # Display last update information
     shared_state = load_state()
     st.sidebar.write(f"Last updated: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(shared_state.get('last_update', 0)))}")
@@ -162,8 +235,7 @@ def main():
 
     if page == "Post Cards":
         st.title("Post Cards")
-        enhanced_posts = session_state.db.getAllEnhancedPost()
-        render_post_cards(enhanced_posts)
+        render_post_cards(session_state.db, session_state.lda)
 
     elif page == "Dynamic Graph":
         st.title("Dynamic Word Co-occurrence Graph")
@@ -174,20 +246,10 @@ def main():
         
         with col2:
             # New slider for number of components
-            max_components = session_state.graph.get_max_components_num()  # You might want to adjust this based on your data
+            max_components = max(session_state.graph.get_max_components_num(min_weight), 1)
             n_components = st.slider("Number of connected components to display", 1, max_components, max_components)
         
-        # Get the graph data in a hashable format
-        graph_data = session_state.graph.get_graph_data()
-        
-        # Use the cached function with the graph data
-        graph_html = get_cached_graph_html(
-            graph_data['nodes'],
-            graph_data['edges'],
-            graph_data['node_sizes'],
-            min_weight,
-            n_components
-        )
+        graph_html = get_render_cache().get_or_render(session_state.graph, session_state.version, min_weight, n_components)
 
         st.components.v1.html(graph_html, height=1200)
 
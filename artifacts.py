@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Optional, Tuple
+from corpus import CorpusManager
+from gensimLDA import GensimLDA
+from graph import Graph
+
+ARTIFACTS_DIR = 'artifacts'
+CURRENT_FILE = 'CURRENT'  # Name of the published version directory
+METADATA_FILE = 'metadata.json'
+GRAPH_SNAPSHOT_FILE = 'graph.npz'
+ARTIFACTS_FORMAT_VERSION = 1
+
+
+def current_version_dir(root=ARTIFACTS_DIR) -> Optional[str]:
+    """ Path of the version directory CURRENT points to, or None when nothing was published yet. """
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, name) if name else None
+
+
+def latest_corpus_version_dir(root=ARTIFACTS_DIR) -> Optional[str]:
+    """ Path of the newest version published with its corpus and texts, or None if there is none. """
+    names = sorted((name for name in os.listdir(root) if not name.startswith('.')), reverse=True) if os.path.isdir(root) else []
+    for name in names:
+        if os.path.isdir(os.path.join(root, name)) and _has_corpus(os.path.join(root, name)):
+            return os.path.join(root, name)
+    return None
+
+
+def publish_artifacts(lda: GensimLDA, corpus_manager: CorpusManager, root=ARTIFACTS_DIR, keep=3,
+                      graph: Optional[Graph] = None, include_corpus=True) -> str:
+    """
+    Writes the model, dictionary, optionally the corpus and texts, and optionally the graph snapshot to a
+    new version directory, then points CURRENT at it.
+    The directory is complete before it gets its final name and CURRENT is replaced atomically, so
+    readers only ever see a whole version. Versions older than the last keep are deleted; processes that
+    loaded one keep reading it, since load_artifacts maps the model arrays and opens every other file up
+    front. The newest version with a corpus is always kept, for processes that need one to start from.
+    :param include_corpus: Also write the corpus and texts, which the dashboard doesn't read. Their size
+        grows with the corpus, so frequent publishers only include them from time to time.
+    :return: Path of the new version directory.
+    """
+    now_ns = time.time_ns()
+    name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now_ns // 10**9))}.{now_ns % 10**9:09d}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(root, f".{name}.tmp")
+    os.makedirs(tmp_dir)
+    corpus_manager.save_artifacts(tmp_dir, include_corpus=include_corpus)
+    lda.save_artifacts(tmp_dir)
+    if graph is not None:
+        graph.save_snapshot(os.path.join(tmp_dir, GRAPH_SNAPSHOT_FILE))
+    with open(os.path.join(tmp_dir, METADATA_FILE), 'w') as f:
+        json.dump({'format_version': ARTIFACTS_FORMAT_VERSION, 'created': time.time(),
+                   'model_version': lda.model_version, 'training_version': lda.training_version,
+                   'corpus': include_corpus}, f)
+
+    version_dir = os.path.join(root, name)
+    os.rename(tmp_dir, version_dir)
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(name)
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+    _prune(root, keep, current=name)
+    return version_dir
+
+
+def load_artifacts(root=ARTIFACTS_DIR, mmap='r', version_dir=None, require_corpus=False,
+                   standalone=False) -> Tuple[GensimLDA, CorpusManager]:
+    """
+    Loads the published version into the CorpusManager singleton and a new GensimLDA. Only the model and
+    the dictionary are read; texts and corpus load on first use, from files opened now so that pruning
+    the version can't remove them first.
+    :param mmap: How the model arrays are mapped, see GensimLDA.load_artifacts.
+    :param version_dir: Version directory to load instead of the one CURRENT points to.
+    :param require_corpus: Load the newest version published with its corpus and texts instead, for
+        processes that keep updating or read the corpus.
+    :param standalone: Load into a new CorpusManager instead of the singleton, leaving anything that
+        still uses the singleton untouched.
+    """
+    version_dir = version_dir or (latest_corpus_version_dir(root) if require_corpus else current_version_dir(root))
+    if version_dir is None:
+        raise FileNotFoundError(f"No model published in {root}. Run the dashboard once to train one.")
+    with open(os.path.join(version_dir, METADATA_FILE)) as f:
+        format_version = json.load(f)['format_version']
+    if format_version != ARTIFACTS_FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifacts format version {format_version} in {version_dir}")
+
+    corpus_manager = CorpusManager.standalone() if standalone else CorpusManager()
+    corpus_manager.load_artifacts(version_dir)
+    lda = GensimLDA.load_artifacts(corpus_manager, version_dir, mmap=mmap)
+    return lda, corpus_manager
+
+
+def load_graph(version_dir) -> Optional[Graph]:
+    """ Loads the graph snapshot published with a version, or None if it was published without one. """
+    path = os.path.join(version_dir, GRAPH_SNAPSHOT_FILE)
+    return Graph.load_snapshot(path) if os.path.isfile(path) else None
+
+
+def _has_corpus(version_dir) -> bool:
+    try:
+        with open(os.path.join(version_dir, METADATA_FILE)) as f:
+            return json.load(f).get('corpus', True)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+
+def _prune(root, keep, current):
+    # Directory names start with their creation time, so they sort oldest first
+    versions = sorted(name for name in os.listdir(root)
+                      if not name.startswith('.') and os.path.isdir(os.path.join(root, name)))
+    latest_corpus = latest_corpus_version_dir(root)
+    kept = {current, os.path.basename(latest_corpus) if latest_corpus else None}
+    for name in versions[:-keep]:
+        if name in kept:
+            continue
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
@@ -0,0 +1,277 @@
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import List
+import numpy as np
+from gensim.corpora.dictionary import Dictionary
+from nltk.corpus import stopwords
+from pymongo import MongoClient
+from cooccurrence import CooccurrenceMatrix
+from corpus import CorpusManager
+from gensimLDA import GensimLDA
+from mongo import WarOpMongoDB
+from tokenizer import Tokenizer, reference_clean_and_tokenize
+from vaderSentimentAnalysis import VaderSentimentAnalyzer, analyze_posts_parallel
+
+# Words used to build synthetic Reddit-like texts
+VOCABULARY = [
+    'war', 'israel', 'palestine', 'ukraine', 'russia', 'gaza', 'ceasefire', 'army', 'soldiers',
+    'civilians', 'attack', 'missile', 'drone', 'border', 'government', 'president', 'minister',
+    'sanctions', 'peace', 'talks', 'hostages', 'killed', 'wounded', 'refugees', 'aid', 'news',
+    'report', 'people', 'country', 'cannot', 'gonna', 'wanna', 'the', 'is', 'was', 'and', 'of',
+]
+NOISE = ['http://www.reddit.com/r/worldnews', '003dl0nlraie1', '_private', 'some_var', '1990s',
+         'deadbeef', '12', '[deleted]', 'café', '— “quoted”', "don't", '!!!', 'u/some_user']
+
+
+def synthetic_texts(num_texts=2000, min_words=5, max_words=120, seed=42) -> List[str]:
+    """ Generates reproducible Reddit-like texts mixing vocabulary and noise. """
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(num_texts):
+        words = [rng.choice(NOISE) if rng.random() < 0.1 else rng.choice(VOCABULARY)
+                 for _ in range(rng.randint(min_words, max_words))]
+        texts.append(' '.join(word.capitalize() if rng.random() < 0.1 else word for word in words))
+    return texts
+
+
+def check_tokenizer_parity(texts: List[str]):
+    """ Asserts that the Tokenizer produces exactly the tokens of the original implementation. """
+    stop_words = stopwords.words("english")
+    tokenizer = Tokenizer(stop_words)
+    for text in texts:
+        expected = reference_clean_and_tokenize(text, stop_words, lemmatizer=tokenizer.lemmatizer)
+        actual = tokenizer.tokenize(text)
+        assert actual == expected, f"Tokenizer mismatch for {text!r}: {actual} != {expected}"
+    print(f"✅ Tokenizer parity verified on {len(texts)} texts")
+
+
+def bench_tokenizer(texts: List[str]):
+    """ Compares the throughput of the original and compiled tokenizers in docs/sec. """
+    stop_words = stopwords.words("english")
+    tokenizer = Tokenizer(stop_words)
+
+    start = time.perf_counter()
+    for text in texts:
+        reference_clean_and_tokenize(text, stop_words, lemmatizer=tokenizer.lemmatizer)
+    reference_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts:
+        tokenizer.tokenize(text)
+    elapsed = time.perf_counter() - start
+
+    print(f"📊 Tokenizer: reference {len(texts) / reference_elapsed:,.0f} docs/sec, "
+          f"compiled {len(texts) / elapsed:,.0f} docs/sec ({reference_elapsed / elapsed:.1f}x)")
+
+
+def synthetic_tokenized_texts(num_texts=20000, vocabulary_size=5000, max_words=150, seed=42) -> List[List[str]]:
+    """ Generates reproducible tokenized documents with a Zipf-like word distribution. """
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(vocabulary_size)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    return [rng.choices(vocabulary, weights, k=rng.randint(0, max_words)) for _ in range(num_texts)]
+
+
+def reference_cooccurrences(tokenized_texts, window_size=2):
+    """ The original nested-loop counting from Graph.create_network_graph. """
+    edge_weights = defaultdict(int)
+    for text in tokenized_texts:
+        for i in range(len(text)):
+            start = max(0, i - window_size)
+            end = min(len(text), i + window_size + 1)
+
+            word1 = text[i]
+            for j in range(start, end):
+                if i != j:
+                    word2 = text[j]
+                    edge = tuple(sorted([word1, word2]))
+                    edge_weights[edge] += 1
+    return edge_weights
+
+
+def check_cooccurrence_parity(tokenized_texts, window_sizes=(0, 1, 2, 3, 5, 200)):
+    """ Asserts that CooccurrenceMatrix gives the same weights as the nested loop for every window size. """
+    for window_size in window_sizes:
+        expected = reference_cooccurrences(tokenized_texts, window_size)
+        actual = {tuple(sorted((word1, word2))): weight
+                  for word1, word2, weight in CooccurrenceMatrix(window_size).add_documents(tokenized_texts).edges()}
+        assert actual == expected, f"Co-occurrence weights differ for window_size={window_size}"
+    print(f"✅ Co-occurrence parity verified for window sizes {list(window_sizes)}")
+
+
+def bench_cooccurrence(tokenized_texts, window_size=2):
+    """ Compares the nested loop with the vectorized co-occurrence counting. """
+    num_tokens = sum(len(text) for text in tokenized_texts)
+
+    start = time.perf_counter()
+    reference_cooccurrences(tokenized_texts, window_size)
+    reference_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    CooccurrenceMatrix(window_size).add_documents(tokenized_texts)
+    elapsed = time.perf_counter() - start
+
+    print(f"📊 Co-occurrence ({num_tokens:,} tokens, window {window_size}): reference {reference_elapsed:.2f}s, "
+          f"vectorized {elapsed:.2f}s ({reference_elapsed / elapsed:.1f}x)")
+
+
+def bench_dedup(client=None, sizes=(1_000, 10_000, 100_000), probes=500):
+    """
+    Times insert-as-dedup of already stored posts as the collection grows. With the unique index on id
+    the cost per duplicate stays flat instead of growing with the collection.
+    :param client: MongoClient to benchmark against (a local mongod by default, or e.g. mongomock.MongoClient()).
+    """
+    client = client if client is not None else MongoClient('mongodb://localhost:27017/')
+    client.drop_database('warOpMiningBench')
+    db = object.__new__(WarOpMongoDB)  # Separate instance, not the application singleton
+    db.initialize(client=client, database='warOpMiningBench')
+
+    stored = 0
+    for size in sizes:
+        db.collection.insert_many([{"id": f"post{i}", "title": "", "comments": []} for i in range(stored, size)], ordered=False)
+        stored = size
+
+        start = time.perf_counter()
+        for i in range(probes):
+            assert not db.insert_if_new({"id": f"post{i * size // probes}"})
+        elapsed = time.perf_counter() - start
+        print(f"📊 Dedup with {size:,} stored posts: {elapsed / probes * 1e6:,.0f} µs per duplicate")
+    client.drop_database('warOpMiningBench')
+
+
+def synthetic_threads(num_posts=300, max_comments=60, seed=42):
+    """ Generates (post text, comments) pairs where a share of comments repeat, like removed or deleted ones. """
+    rng = random.Random(seed)
+    texts = synthetic_texts(num_posts * 4, max_words=40, seed=seed)
+    repeated = ['[deleted]', '[removed]', 'This.', 'lol', 'Source?']
+    return [(rng.choice(texts), [rng.choice(repeated) if rng.random() < 0.3 else rng.choice(texts)
+                                 for _ in range(rng.randint(0, max_comments))])
+            for _ in range(num_posts)]
+
+
+def reference_overall_post_sentiment(analyzer: VaderSentimentAnalyzer, text_post, comments, ratio=0.5):
+    """ The original per-comment scoring of VaderSentimentAnalyzer.analyze_overall_post_sentiment. """
+    def analyze_sentiment(text):
+        sentiment_scores = analyzer.analyzer.polarity_scores(' '.join(analyzer.corpus_manager.clean_and_tokenize(text)))
+        compound = sentiment_scores["compound"]
+        return "Positive" if compound >= 0.5 else "Negative" if compound <= -0.5 else "Neutral", sentiment_scores
+
+    main_classifier, main_post_sentiment_scores = analyze_sentiment(text_post)
+    comment_scores = [analyze_sentiment(comment)[1] for comment in comments]
+    num_items = len(comment_scores)
+    if num_items == 0:
+        return main_classifier, main_post_sentiment_scores
+
+    overall = {key: main_post_sentiment_scores[key] * ratio + sum(x[key] for x in comment_scores) / num_items * (1 - ratio)
+               for key in ("neg", "neu", "pos", "compound")}
+    compound = overall["compound"]
+    return "Positive" if compound >= 0.5 else "Negative" if compound <= -0.5 else "Neutral", overall
+
+
+def bench_sentiment(threads=None, ratio=0.7):
+    """ Checks that batched scoring matches the per-comment scores exactly, and compares their throughput. """
+    threads = threads if threads is not None else synthetic_threads()
+    corpus_manager = CorpusManager()
+    corpus_manager.token_cache = None  # Time tokenization too, not a warm token cache
+    analyzer = VaderSentimentAnalyzer(corpus_manager)
+    num_texts = sum(1 + len(comments) for _, comments in threads)
+
+    start = time.perf_counter()
+    expected = [reference_overall_post_sentiment(analyzer, text_post, comments, ratio) for text_post, comments in threads]
+    reference_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = analyzer.analyze_overall_post_sentiments(threads, ratio=ratio)
+    elapsed = time.perf_counter() - start
+
+    assert actual == expected, "Batched sentiment scores differ from the per-comment scores"
+    print(f"✅ Sentiment parity verified on {len(threads)} posts")
+    print(f"📊 Sentiment ({num_texts:,} texts): per comment {num_texts / reference_elapsed:,.0f} texts/sec, "
+          f"batched {num_texts / elapsed:,.0f} texts/sec ({reference_elapsed / elapsed:.1f}x)")
+
+
+def bench_sentiment_parallel(threads=None, ratio=0.7, process_counts=None):
+    """ Times the multi-process sentiment backend for growing process counts against the in-process one. """
+    threads = threads if threads is not None else synthetic_threads(num_posts=3000)
+    corpus_manager = CorpusManager()
+    num_texts = sum(1 + len(comments) for _, comments in threads)
+    process_counts = process_counts or sorted({1, 2, 4, os.cpu_count()})
+
+    start = time.perf_counter()
+    expected = VaderSentimentAnalyzer(corpus_manager).analyze_posts(threads, ratio=ratio)
+    serial_elapsed = time.perf_counter() - start
+    print(f"📊 Sentiment in-process ({num_texts:,} texts): {num_texts / serial_elapsed:,.0f} texts/sec")
+
+    for processes in process_counts:
+        start = time.perf_counter()
+        actual = analyze_posts_parallel(threads, corpus_manager.tokenizer, ratio=ratio, processes=processes)
+        elapsed = time.perf_counter() - start
+        assert actual == expected, f"Sentiment scores differ with {processes} processes"
+        print(f"📊 Sentiment with {processes} processes: {num_texts / elapsed:,.0f} texts/sec "
+              f"({serial_elapsed / elapsed:.1f}x in-process)")
+
+
+def bench_lda(tokenized_texts=None, backends=(('single', None), ('multicore', 1), ('multicore', None)), num_topics=5):
+    """
+    Trains the LDA model with each (backend, workers) pair on the same corpus and compares wall time,
+    c_v coherence and perplexity.
+    """
+    tokenized_texts = tokenized_texts if tokenized_texts is not None else synthetic_tokenized_texts(5000, 2000, 100)
+    corpus_manager = CorpusManager()
+    corpus_manager.tokenized_texts = tokenized_texts
+    corpus_manager.dictionary = Dictionary(tokenized_texts)
+    corpus_manager.corpus = [corpus_manager.dictionary.doc2bow(text) for text in tokenized_texts]
+
+    for backend, workers in backends:
+        lda = GensimLDA(corpus_manager, num_topics=num_topics, backend=backend, workers=workers)
+        start = time.perf_counter()
+        lda.train_gensim()
+        elapsed = time.perf_counter() - start
+        perplexity = np.exp2(-lda.get_perplexity())
+        print(f"📊 LDA {backend} (workers={workers or 'default'}, {len(tokenized_texts):,} docs): {elapsed:.1f}s, "
+              f"coherence {lda.get_coherence():.3f}, perplexity {perplexity:.1f}")
+
+
+def bench_topics(texts=None, num_train=1000):
+    """ Compares per-article topic prediction with batch inference, and how often their dominant topics agree. """
+    texts = texts if texts is not None else synthetic_texts(3000)
+    corpus_manager = CorpusManager()
+    corpus_manager.texts = texts[:num_train]
+    corpus_manager.rebuild_corpus()
+    lda = GensimLDA(corpus_manager)
+    lda.train_gensim()
+    articles = texts[num_train:]
+
+    start = time.perf_counter()
+    expected = [max(lda.lda_model[lda._known_bow(corpus_manager.dictionary.doc2bow(corpus_manager.clean_and_tokenize(article)))][0],
+                    key=lambda x: x[1])[0] for article in articles]
+    reference_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [topic["topic_id"] for topic in lda.predict_topics(articles)]
+    elapsed = time.perf_counter() - start
+
+    # Inference starts from a random gamma, so per-call and batched draws can differ on near ties
+    agreement = sum(a == b for a, b in zip(actual, expected)) / len(articles)
+    print(f"📊 Topics ({len(articles):,} articles): per article {len(articles) / reference_elapsed:,.0f} docs/sec, "
+          f"batched {len(articles) / elapsed:,.0f} docs/sec ({reference_elapsed / elapsed:.1f}x), "
+          f"{agreement:.1%} same dominant topic")
+
+
+BENCHMARKS = {
+    'tokenizer': lambda: (check_tokenizer_parity(synthetic_texts(500)), bench_tokenizer(synthetic_texts())),
+    'cooccurrence': lambda: (check_cooccurrence_parity(synthetic_tokenized_texts(500, 200, 30)),
+                             bench_cooccurrence(synthetic_tokenized_texts())),
+    'dedup': bench_dedup,
+    'sentiment': bench_sentiment,
+    'sentiment_parallel': bench_sentiment_parallel,
+    'lda': bench_lda,
+    'topics': bench_topics,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
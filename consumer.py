@@ -1,28 +1,85 @@
+import os
 import time
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
 import pika
 from graph import Graph
+from cooccurrence import CooccurrenceMatrix
 from mongo import WarOpMongoDB
 import json
 from gensimLDA import GensimLDA
 from corpus import CorpusManager
-import pickle
-from dataStructures import EnhancedPostDataStructure, PostDataStructure
+from dataStructures import EnhancedPostDataStructure, PostDataStructure, to_post
 from vaderSentimentAnalysis import VaderSentimentAnalyzer
-from shared_state import load_state, update_state
+from shared_state import bump_version
+from pipeline import Pipeline, ReadWriteLock
+from artifacts import load_artifacts, publish_artifacts
+import enrichment
 
 
-# Load the trained LDA model and corpus_manager
-with open('trained_lda_model.pkl', 'rb') as f:
-    lda, corpus_manager = pickle.load(f)
+# Load the LDA model and corpus_manager last published with the corpus, copy-on-write since online updates change
+# the model. Posts stored after that version are added back by catch_up before consuming starts.
+lda, corpus_manager = load_artifacts(mmap='c', require_corpus=True)
+
+STREAM_OFFSET_PATH = os.path.join('cache-directory', 'stream_offset.json')
+DEAD_LETTER_PATH = os.path.join('cache-directory', 'dead_letters.jsonl')
+
+
+@dataclass
+class _PendingBatch:
+    messages: list  # (delivery tag, stream offset, body) of every message, in delivery order
+    attempts: int = 0
+    done: bool = False
+
+    @property
+    def bodies(self):
+        return [body for _, _, body in self.messages]
+
 
 class RabbitMQConsumer:
-    def __init__(self, callback, db, lda, corpus_manager) -> None:
+    def __init__(self, callback, db, lda, corpus_manager, batch_callback=None, batch_size=1, batch_timeout_ms=500,
+                 pipeline_stages=None, prefetch_count=10, max_retries=3, retry_delay_ms=1000,
+                 offset_path=STREAM_OFFSET_PATH, dead_letter_path=DEAD_LETTER_PATH) -> None:
+        """
+        The queue is a stream: acks only return prefetch credit and a nack never redelivers a message. Failed
+        messages are retried in-process instead, and what survives a crash is the stream offset of the last
+        settled message, saved to offset_path and resumed from on the next start.
+        :param callback: Called with (channel, method, properties, body) for every message, and acks it.
+        :param batch_callback: Called with a list of message bodies when batching. The batch is acked
+            with a single multiple=True ack once it returns.
+        :param batch_size: Number of messages collected before batch_callback runs.
+        :param batch_timeout_ms: Longest time a partial batch waits before it is processed anyway.
+        :param pipeline_stages: (function, workers) pairs. When given, batches of bodies run through these
+            stages on worker threads instead of batch_callback on the connection thread, and are acked
+            on the connection thread in delivery-tag order once every stage is done.
+        :param prefetch_count: Unacknowledged messages the broker may deliver. It bounds the messages in
+            flight, so it is what throttles consumption when the pipeline falls behind.
+        :param max_retries: Times a failed message or batch is processed again before it is given up on.
+        :param retry_delay_ms: Wait before the first retry, doubled for each following one.
+        :param offset_path: File keeping the stream offset of the last settled message, None to always
+            start from the next message published.
+        :param dead_letter_path: JSON lines file recording the messages given up on, with their error.
+        """
         self.__host = "localhost"
         self.__port = 5672
         self.__username = "guest"
         self.__password = "guest"
         self.__queue = "mensagens_3"
         self.__callback = callback
+        self.__pipeline = Pipeline(pipeline_stages) if pipeline_stages else None
+        self.__batch_callback = batch_callback if batch_size > 1 or self.__pipeline else None
+        self.__batch_size = batch_size
+        self.__prefetch_count = max(prefetch_count, batch_size * 2 if self.__pipeline else batch_size)
+        self.__max_retries = max_retries
+        self.__retry_delay = retry_delay_ms / 1000
+        self.__offset_path = offset_path
+        self.__dead_letter_path = dead_letter_path
+        self.__pending_acks = deque()  # _PendingBatch of every batch in the pipeline, in delivery order
+        self.__batch_timeout = batch_timeout_ms / 1000
+        self.__batch = []
+        self.__batch_timer = None
+        self.__connection = None
         self.__channel = self.__create_channel()
         self.db = db
         self.lda = lda
@@ -38,7 +95,8 @@ class RabbitMQConsumer:
             )
         )
 
-        channel = pika.BlockingConnection(conections_parameters).channel()
+        self.__connection = pika.BlockingConnection(conections_parameters)
+        channel = self.__connection.channel()
 
         # Criando a fila do tipo "stream"
         channel.queue_declare(
@@ -48,28 +106,224 @@ class RabbitMQConsumer:
         )
 
         # ✅ Configurar PEFETCH COUNT (necessário para fila tipo Stream)
-        channel.basic_qos(prefetch_count=10)  # Ajuste conforme o necessário
+        # Um lote inteiro precisa caber na janela de prefetch
+        channel.basic_qos(prefetch_count=self.__prefetch_count)  # Ajuste conforme o necessário
+
+        # Resume right after the last settled message, replaying whatever a crash left unsettled
+        last_offset = self.__load_offset()
+        if last_offset is not None:
+            print(f"↩ Resuming the stream after offset {last_offset}")
 
         # ✅ Consumir mensagens da fila
         channel.basic_consume(
             queue=self.__queue,
             auto_ack=False,  # Pode ser False se precisar de confirmação manual
-            on_message_callback=self.__callback
+            on_message_callback=self.__on_message if self.__batch_callback else self.__on_single_message,
+            arguments={'x-stream-offset': last_offset + 1} if last_offset is not None else None
         )
 
         return channel
 
+    def __load_offset(self):
+        if self.__offset_path is None:
+            return None
+        try:
+            with open(self.__offset_path) as f:
+                return json.load(f)['offset']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def __save_offset(self, offset):
+        """ Records the stream offset of the last settled message, atomically so a crash never truncates it. """
+        if self.__offset_path is None or offset is None:
+            return
+        os.makedirs(os.path.dirname(self.__offset_path) or '.', exist_ok=True)
+        tmp_path = f"{self.__offset_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'offset': offset}, f)
+        os.replace(tmp_path, self.__offset_path)
+
+    def __dead_letter(self, messages, error):
+        """ Appends the messages given up on to the dead letter file, so they can be inspected and replayed. """
+        print(f"☠ Giving up on {len(messages)} messages after {self.__max_retries} retries: {error!r}")
+        os.makedirs(os.path.dirname(self.__dead_letter_path) or '.', exist_ok=True)
+        with open(self.__dead_letter_path, 'a') as f:
+            for _, offset, body in messages:
+                f.write(json.dumps({'offset': offset, 'failed_at': time.time(), 'error': repr(error),
+                                    'body': body.decode('utf-8', errors='replace')}) + '\n')
+
+    def __run_with_retries(self, function, args, messages) -> bool:
+        """
+        Runs function(*args) on the connection thread, retrying it with a backoff while it fails.
+        :return: Whether it succeeded, False once the messages were dead-lettered.
+        """
+        for attempt in range(self.__max_retries + 1):
+            try:
+                function(*args)
+                return True
+            except Exception as error:
+                if attempt == self.__max_retries:
+                    self.__dead_letter(messages, error)
+                    return False
+                delay = self.__retry_delay * 2 ** attempt
+                print(f"⚠ Error processing {len(messages)} messages, retrying in {delay:.1f}s: {error!r}")
+                self.__connection.sleep(delay)  # Keeps heartbeats going; deliveries wait until this callback returns
+
+    @staticmethod
+    def __stream_offset(properties):
+        return (properties.headers or {}).get('x-stream-offset')
+
+    def __on_single_message(self, ch, method, properties, body):
+        messages = [(method.delivery_tag, self.__stream_offset(properties), body)]
+        if not self.__run_with_retries(self.__callback, (ch, method, properties, body), messages):
+            ch.basic_ack(delivery_tag=method.delivery_tag)  # The callback acks the messages it processed
+        self.__save_offset(messages[0][1])
+
+    def __on_message(self, ch, method, properties, body):
+        self.__batch.append((method.delivery_tag, self.__stream_offset(properties), body))
+        if len(self.__batch) >= self.__batch_size:
+            self.__flush()
+        elif self.__batch_timer is None:
+            self.__batch_timer = self.__connection.call_later(self.__batch_timeout, self.__on_batch_timeout)
+
+    def __on_batch_timeout(self):
+        self.__batch_timer = None
+        self.__flush()
+
+    def __flush(self):
+        if self.__batch_timer is not None:
+            self.__connection.remove_timeout(self.__batch_timer)
+            self.__batch_timer = None
+        if not self.__batch:
+            return
+
+        batch, self.__batch = self.__batch, []
+        if self.__pipeline is None:
+            self.__run_with_retries(self.__batch_callback, ([body for _, _, body in batch],), batch)
+            # Delivery tags grow monotonically on a channel, so one ack covers the whole batch
+            self.__channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+            self.__save_offset(batch[-1][1])
+            return
+
+        pending = _PendingBatch(batch)
+        self.__pending_acks.append(pending)
+        self.__submit(pending)
+
+    def __submit(self, pending: _PendingBatch):
+        self.__pipeline.submit(pending.bodies, lambda error: self.__connection.add_callback_threadsafe(
+            partial(self.__on_batch_done, pending, error)))
+
+    def __on_batch_done(self, pending: _PendingBatch, error):
+        """
+        Runs on the connection thread. A failed batch goes through the pipeline again after a backoff, up
+        to max_retries times, and is then dead-lettered. Once it is done either way, every finished batch
+        not preceded by an unfinished one is acked and its stream offset saved.
+        """
+        if error is not None:
+            if pending.attempts < self.__max_retries:
+                delay = self.__retry_delay * 2 ** pending.attempts
+                pending.attempts += 1
+                print(f"⚠ Error processing batch ending at delivery tag {pending.messages[-1][0]}, "
+                      f"retrying in {delay:.1f}s: {error!r}")
+                self.__connection.call_later(delay, partial(self.__submit, pending))
+                return
+            self.__dead_letter(pending.messages, error)
+        pending.done = True
+
+        settled = None
+        while self.__pending_acks and self.__pending_acks[0].done:
+            settled = self.__pending_acks.popleft()
+        if settled is not None:
+            # Every earlier message is settled too, so one ack covers them all
+            self.__channel.basic_ack(delivery_tag=settled.messages[-1][0], multiple=True)
+            self.__save_offset(settled.messages[-1][1])
+
     def start(self):
         print(f"Listening to RabbitMQ on port {self.__port}, queue: {self.__queue}")
-        self.__channel.start_consuming()
+        try:
+            self.__channel.start_consuming()
+        finally:
+            if self.__pipeline is not None:
+                self.__pipeline.shutdown()
 
 message_count = 0
 UPDATE_THRESHOLD = 10  # Update after every 20 new messages
+GRAPH_MIN_WEIGHT = 100
+BATCH_SIZE = 50  # Messages processed together, 1 to handle messages one at a time
+BATCH_TIMEOUT_MS = 500  # Longest a partial batch waits for more messages
+ENRICH_WORKERS = 4  # Threads running topic and sentiment analysis, 0 to process batches on the connection thread
+FULL_PUBLISH_EVERY = 50  # Model updates between published versions that also carry the corpus, to restart from
+bucket_posts: list[PostDataStructure] = []
+updates_since_full_publish = 0
+
+# Enrichment threads read the LDA model and dictionary while the persist thread updates them
+model_lock = ReadWriteLock()
+
+# Co-occurrence weights of the whole corpus, extended with each new bucket of posts
+cooccurrences = CooccurrenceMatrix().add_documents(corpus_manager.get_tokenized_texts())
+
+def enrich_post(post: PostDataStructure) -> EnhancedPostDataStructure:
+    return enrich_posts([post])[0]
+
+def enrich_posts(posts: list[PostDataStructure]) -> list[EnhancedPostDataStructure]:
+    """ Runs topic and sentiment analysis, scoring the texts and comments of all posts in one batch. """
+    with model_lock.reading():
+        return enrichment.enrich_posts(posts, lda, sentiment_analyzer)
+
+def add_to_bucket(posts: list[PostDataStructure]):
+    """ Counts new posts and updates the models once UPDATE_THRESHOLD of them arrived. """
+    global message_count, bucket_posts, updates_since_full_publish
+    message_count += len(posts)
+    bucket_posts.extend(posts)
+
+    if message_count >= UPDATE_THRESHOLD:
+        print("Updating LDA model and Graph")
+        num_texts = len(corpus_manager.get_tokenized_texts())
+        training_version = lda.training_version
+        with model_lock.writing():
+            corpus_manager.update_corpus(bucket_posts)
+            lda.update_gensim()  # Folds in the new documents, or retrains when the model went stale
+
+        # Only this thread changes the model, dictionary and corpus, so they are read without the lock from here on
+        cooccurrences.add_documents(corpus_manager.get_tokenized_texts()[num_texts:])
+        graph = Graph.from_cooccurrences(cooccurrences, min_weight=GRAPH_MIN_WEIGHT)
+        # Loaded by the dashboard on the next version, which only reads the model, dictionary and graph
+        updates_since_full_publish += 1
+        include_corpus = updates_since_full_publish >= FULL_PUBLISH_EVERY
+        version_dir = publish_artifacts(lda, corpus_manager, graph=graph, include_corpus=include_corpus)
+        if include_corpus:
+            updates_since_full_publish = 0
+
+        if lda.training_version != training_version:
+            # A retrain renumbers the topics: re-enrich the stored posts before the dashboard sees the new version,
+            # since in READ_ONLY mode it never re-enriches them itself
+            enrichment.backfill_enrichment(db, lda, sentiment_analyzer)
+
+        # Update shared state with version and timestamp, in one atomic write
+        bump_version(last_update=time.time(), total_posts=db.countEnhancedPosts(),
+                     artifacts=os.path.basename(version_dir))
+        
+        bucket_posts = []
+        message_count = 0 # Reset counter
+
+def catch_up():
+    """
+    Adds the stored posts missing from the loaded corpus, i.e. the ones inserted after the version it was
+    published with, to the corpus, the model and the graph.
+    """
+    stored_ids = db.findAllPostIds()
+    try:
+        missing_ids = stored_ids.difference(corpus_manager.post_ids)
+    except AttributeError:
+        print("⚠ The loaded version doesn't record its post ids; posts stored after it can't be found and stay "
+              "out of the corpus until it is rebuilt from the database")
+        corpus_manager.post_ids = sorted(stored_ids)
+        return
+    if missing_ids:
+        print(f"📢 Catching up on {len(missing_ids)} posts stored after the loaded version")
+        add_to_bucket(db.findPostsByIds(missing_ids))
 
 def callback(ch, method, properties, body):
-    global message_count
-    bucket_posts: list[PostDataStructure] = []
-    
     message = body.decode()
     try:
         json_message = json.loads(message)
@@ -79,105 +333,86 @@ def callback(ch, method, properties, body):
         return
 
     print(f"📩 Received: {json_message.get('id', 'No ID')}")
-    existing_post = db.findPostById(json_message.get('id'))
-    
-    if existing_post is None:
+
+    # Posts are only stored once enriched: if enrichment fails, the post is still unknown when RabbitMQConsumer
+    # retries the message, or replays it from the saved stream offset after a crash, and is enriched again
+    if not db.findExistingPostIds([json_message.get('id')]):
         print(f" ID [{json_message.get('id', 'No ID')}] is new. Processing and adding to the database.")
+        post = to_post(json_message)
         
-        # Insert into MongoDB collection
-        inserted_id = db.insert_new_post(json_message)
-        
-        if inserted_id:
-            # Process the post
-            id = json_message.get('id', '')
-            title = json_message.get('title', '')
-            upvote_ratio = json_message.get('upvote_ratio', 0.0)
-            author = json_message.get('author', '')
-            created_utc = json_message.get('created_utc', '')
-            score = json_message.get('score', 0)
-            url = json_message.get('url', '')
-            selftext = json_message.get('selftext', '')
-            num_comments = json_message.get('num_comments', [])
-            comments = json_message.get('comments', [])
-            
-            topic = lda.predict_topic(article=selftext)
-            sentiment, sentiment_probs = sentiment_analyzer.analyze_sentiment(selftext)
-            overall_sentiment, overall_sentiment_probs = sentiment_analyzer.analyze_overall_post_sentiment(
-                selftext, comments, ratio=0.7
-            )
-            
-            # Create EnhancedPostDataStructure
-            enhanced_post = EnhancedPostDataStructure(
-                id=id,
-                title=title,
-                upvote_ratio=upvote_ratio,
-                author=author,
-                created_utc=created_utc,
-                score=score,
-                url=url,
-                selftext=selftext,
-                num_comments=num_comments,
-                comments=comments,
-                sentiment_score={
-                    "label": sentiment,
-                    "probs": sentiment_probs
-                },
-                overall_sentiment_score={
-                    "label": overall_sentiment,
-                    "probs": overall_sentiment_probs
-                },
-                topic=topic
-            )
-            
-            # Save to local storage
-            db.saveEnhancedPost(enhanced_post)
-            
-            message_count += 1
-
-            bucket_posts.append(
-                PostDataStructure(
-                    id=id,
-                    title=title,
-                    upvote_ratio=upvote_ratio,
-                    author=author,
-                    created_utc=created_utc,
-                    score=score,
-                    url=url,
-                    selftext=selftext,
-                    num_comments=num_comments,
-                    comments=comments
-                )
-            )
-            
-            if message_count >= UPDATE_THRESHOLD:
-                print("Updating LDA model and Graph")
-                lda.train_gensim()
-                
-                corpus_manager.update_corpus(bucket_posts)
-                graph = Graph()
-                graph.create_network_graph(corpus_manager.get_tokenized_texts(), min_weight=100)
-
-                # Update shared state with version and timestamp
-                current_state = load_state()
-                current_version = current_state.get('version', 0) + 1
-                
-                update_state('version', current_version)
-                update_state('last_update', time.time())
-                update_state('total_posts', len(db.getAllEnhancedPost()))
-                
-                bucket_posts = []
-                message_count = 0 # Reset counter
-        else:
-            print(f"Failed to insert post with ID: {json_message.get('id', 'No ID')}")
+        # Save to local storage; the unique index on id rejects the post if it was stored meanwhile
+        db.saveEnhancedPost(enrich_post(post))
+        if db.insert_if_new(json_message):
+            add_to_bucket([post])
     else:
         print(f" ID [{json_message.get('id', 'No ID')}] already in the database.")
 
     # Manually acknowledge the message
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
+def decode_stage(bodies: list[bytes]) -> list[dict]:
+    """ Decodes a batch and drops repeated posts and posts that are already stored, with one indexed query. """
+    json_messages = {}
+    for body in bodies:
+        message = body.decode()
+        try:
+            json_message = json.loads(message)
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON: {message}")
+            continue
+        json_messages.setdefault(json_message.get('id'), json_message)  # Keep the first copy of repeated ids
+
+    existing_ids = db.findExistingPostIds(list(json_messages))
+    print(f"📩 Received {len(bodies)} messages: {len(json_messages) - len(existing_ids)} new, {len(existing_ids)} already seen.")
+    return [json_message for post_id, json_message in json_messages.items() if post_id not in existing_ids]
+
+def enrich_stage(json_messages: list[dict]) -> list[tuple[dict, PostDataStructure, EnhancedPostDataStructure]]:
+    """ Runs topic and sentiment analysis on the new posts of a batch. """
+    posts = [to_post(json_message) for json_message in json_messages]
+    return list(zip(json_messages, posts, enrich_posts(posts)))
+
+def persist_stage(enriched: list[tuple[dict, PostDataStructure, EnhancedPostDataStructure]]):
+    """
+    Stores the enhanced posts of a batch, then the posts themselves, and feeds the ones inserted to the model
+    updates. Posts are stored last: if anything fails before, they are still unknown when RabbitMQConsumer
+    retries the batch, or replays it from the saved stream offset after a crash, so they get enriched again.
+    A batch that keeps failing is dead-lettered instead. The unique index on id drops posts another batch
+    stored meanwhile.
+    """
+    if not enriched:
+        return
+    # Batches enriched before a retrain that the persist thread ran meanwhile are scored again with the new model
+    stale = [i for i, (_, _, enhanced_post) in enumerate(enriched) if enhanced_post.model_version != lda.training_version]
+    if stale:
+        for i, enhanced_post in zip(stale, enrich_posts([enriched[i][1] for i in stale])):
+            json_message, post, _ = enriched[i]
+            enriched[i] = (json_message, post, enhanced_post)
+    db.saveBucketEnhancedPosts([enhanced_post for _, _, enhanced_post in enriched])
+    inserted_ids = set(db.insert_new_posts([json_message for json_message, _, _ in enriched]))
+    add_to_bucket([post for json_message, post, _ in enriched if json_message.get('id') in inserted_ids])
+
+def batch_callback(bodies: list[bytes]):
+    """
+    Processes a batch of messages on the connection thread: one query that skips known posts, enrichment
+    of the new ones, then one bulk write of each. Acknowledging the batch is left to RabbitMQConsumer.
+    """
+    persist_stage(enrich_stage(decode_stage(bodies)))
+
 db = WarOpMongoDB()
 sentiment_analyzer = VaderSentimentAnalyzer(corpus_manager)
+corpus_manager.tokenizer.lemmatizer.lemmatize('war')  # Load WordNet now, its lazy loading isn't thread-safe
+catch_up()
 
 # Criando e iniciando o consumidor
-DBconsumer = RabbitMQConsumer(callback=callback, db=db, lda=lda, corpus_manager=corpus_manager)
-DBconsumer.start()
\ No newline at end of file
+# Decoding and persistence are single-threaded, so model updates never overlap. Persistence gets batches in the
+# order enrichment finishes them; acks still go out in delivery order.
+pipeline_stages = [(decode_stage, 1), (enrich_stage, ENRICH_WORKERS), (persist_stage, 1)] if ENRICH_WORKERS else None
+DBconsumer = RabbitMQConsumer(callback=callback, db=db, lda=lda, corpus_manager=corpus_manager,
+                              batch_callback=batch_callback, batch_size=BATCH_SIZE, batch_timeout_ms=BATCH_TIMEOUT_MS,
+                              pipeline_stages=pipeline_stages, prefetch_count=BATCH_SIZE * (ENRICH_WORKERS + 2))
+try:
+    DBconsumer.start()
+finally:
+    if updates_since_full_publish:
+        # Publish the corpus the model was updated with, so the next start resumes from it
+        publish_artifacts(lda, corpus_manager, graph=Graph.from_cooccurrences(cooccurrences, min_weight=GRAPH_MIN_WEIGHT))
\ No newline at end of file
@@ -0,0 +1,131 @@
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+
+_ID_BITS = 32  # A pair of token ids is packed into one int64 key: (smaller id << 32) | larger id
+_ID_MASK = (1 << _ID_BITS) - 1
+
+
+class CooccurrenceMatrix:
+    def __init__(self, window_size=2):
+        """
+        Counts how often two tokens appear within window_size positions of each other.
+        Tokens are mapped to integer ids and pair counts are accumulated with NumPy, giving
+        the same weights as counting every (word, neighbour) pair in Python. Weights below
+        any threshold are kept, so documents can be added over time and edges cross the
+        threshold once they become frequent enough.
+        :param window_size: Number of positions on each side of a token considered neighbours.
+        """
+        self.window_size = window_size
+        self.token2id: Dict[str, int] = {}
+        self.vocabulary: List[str] = []
+        self.keys = np.empty(0, dtype=np.int64)  # Sorted packed pair keys
+        self.counts = np.empty(0, dtype=np.int64)  # Weight of each key
+        self._pending = []  # Batches added since the last merge
+        self._pending_size = 0
+        self.merge_threshold = 1_000_000  # Pending pairs above which batches are merged eagerly
+        self.num_docs = 0
+
+    def _encode(self, tokenized_texts) -> Tuple[np.ndarray, np.ndarray]:
+        """ Maps the tokens of all documents to ids and returns them with the document of each token. """
+        token2id = self.token2id
+        ids, lengths = [], []
+        for text in tokenized_texts:
+            for token in text:
+                token_id = token2id.get(token)
+                if token_id is None:
+                    token_id = token2id[token] = len(self.vocabulary)
+                    self.vocabulary.append(token)
+                ids.append(token_id)
+            lengths.append(len(text))
+        return np.array(ids, dtype=np.int64), np.repeat(np.arange(len(lengths)), lengths)
+
+    def count_pairs(self, tokenized_texts) -> Tuple[np.ndarray, np.ndarray]:
+        """ Counts the window co-occurrences of a batch of documents as (sorted keys, counts). """
+        ids, doc_ids = self._encode(tokenized_texts)
+        batch_keys = []
+        for offset in range(1, self.window_size + 1):
+            left, right = ids[:-offset], ids[offset:]
+            same_doc = doc_ids[:-offset] == doc_ids[offset:]
+            left, right = left[same_doc], right[same_doc]
+            batch_keys.append((np.minimum(left, right) << _ID_BITS) | np.maximum(left, right))
+        if not batch_keys:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        keys, counts = np.unique(np.concatenate(batch_keys), return_counts=True)
+        # Each pair is seen once from either side of the window
+        return keys, counts.astype(np.int64) * 2
+
+    def add_documents(self, tokenized_texts):
+        """
+        Adds the co-occurrences of the given documents to the accumulated weights. Counting depends only
+        on the batch; merging into the full table is deferred until the weights are read, and then only
+        locates the batch's keys in the table instead of sorting the table again.
+        """
+        tokenized_texts = list(tokenized_texts)
+        keys, counts = self.count_pairs(tokenized_texts)
+        self.num_docs += len(tokenized_texts)
+        if len(keys):
+            self._pending.append((keys, counts))
+            self._pending_size += len(keys)
+        if self._pending_size > self.merge_threshold:
+            self._consolidate()
+        return self
+
+    def _consolidate(self):
+        """ Merges the pending batches into the sorted weight table. """
+        if not self._pending:
+            return
+        if len(self._pending) == 1:
+            keys, counts = self._pending[0]
+        else:
+            keys, inverse = np.unique(np.concatenate([keys for keys, _ in self._pending]), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate([counts for _, counts in self._pending]),
+                                 minlength=len(keys)).astype(np.int64)
+        self.keys, self.counts = _merge(self.keys, self.counts, keys, counts)
+        self._pending = []
+        self._pending_size = 0
+
+    def edges(self, min_weight=1) -> Iterator[Tuple[str, str, int]]:
+        """ Yields (word1, word2, weight) for every pair with a weight of at least min_weight. """
+        self._consolidate()
+        mask = self.counts >= min_weight
+        keys = self.keys[mask]
+        vocabulary = self.vocabulary
+        for u, v, weight in zip((keys >> _ID_BITS).tolist(), (keys & _ID_MASK).tolist(), self.counts[mask].tolist()):
+            yield vocabulary[u], vocabulary[v], weight
+
+    def edge_arrays(self, min_weight=1) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the pairs with a weight of at least min_weight as arrays over a compact vocabulary
+        holding only the tokens that appear in those pairs.
+        :return: (vocabulary, source ids, target ids, weights)
+        """
+        self._consolidate()
+        mask = self.counts >= min_weight
+        keys = self.keys[mask]
+        used, ids = np.unique(np.concatenate([keys >> _ID_BITS, keys & _ID_MASK]), return_inverse=True)
+        vocabulary = self.vocabulary
+        return [vocabulary[i] for i in used.tolist()], ids[:len(keys)], ids[len(keys):], self.counts[mask]
+
+    def __len__(self):
+        self._consolidate()
+        return len(self.keys)
+
+
+def _merge(keys, counts, new_keys, new_counts):
+    """
+    Merges the sorted (new_keys, new_counts) batch into the sorted (keys, counts) table. Shared keys are
+    added in place and only the keys new to the table are inserted: O(batch log table) to locate them,
+    plus one copy of the table when some are new, instead of re-sorting the whole table.
+    """
+    if not len(keys):
+        return new_keys, new_counts
+    if not len(new_keys):
+        return keys, counts
+    positions = np.searchsorted(keys, new_keys)
+    found = keys[np.minimum(positions, len(keys) - 1)] == new_keys
+    counts[positions[found]] += new_counts[found]  # new_keys are unique, so each position is added once
+    if found.all():
+        return keys, counts
+    missing = ~found
+    return np.insert(keys, positions[missing], new_keys[missing]), np.insert(counts, positions[missing], new_counts[missing])
@@ -0,0 +1,41 @@
+import random
+from collections import Counter
+from cooccurrence import CooccurrenceMatrix
+
+VOCABULARY = ["war", "peace", "army", "border", "talks", "drone", "city", "aid", "front", "sanction"]
+
+
+def _tokenized_texts(num_texts, seed):
+    rng = random.Random(seed)
+    return [[rng.choice(VOCABULARY) for _ in range(rng.randint(0, 30))] for _ in range(num_texts)]
+
+
+def _reference_edges(tokenized_texts, window_size=2):
+    """ Counts every (word, neighbour) pair in plain Python, as the graph was originally built. """
+    weights = Counter()
+    for text in tokenized_texts:
+        for i, word in enumerate(text):
+            for j in range(max(0, i - window_size), min(len(text), i + window_size + 1)):
+                if i != j:
+                    weights[tuple(sorted((word, text[j])))] += 1
+    return weights
+
+
+def _edges(matrix, min_weight=1):
+    return {tuple(sorted((u, v))): weight for u, v, weight in matrix.edges(min_weight)}
+
+
+def test_incremental_batches_match_a_single_batch():
+    tokenized_texts = _tokenized_texts(300, seed=1)
+    batch = CooccurrenceMatrix().add_documents(tokenized_texts)
+
+    incremental = CooccurrenceMatrix()
+    incremental.merge_threshold = 50  # Merge some batches eagerly and leave others pending
+    for start in range(0, len(tokenized_texts), 37):
+        incremental.add_documents(tokenized_texts[start:start + 37])
+        if start % 3 == 0:
+            len(incremental)  # Reading the weights consolidates the pending batches
+
+    assert _edges(incremental) == _edges(batch) == dict(_reference_edges(tokenized_texts))
+    assert _edges(incremental, min_weight=40) == _edges(batch, min_weight=40)
+    assert incremental.num_docs == batch.num_docs == len(tokenized_texts)
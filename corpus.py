@@ -1,18 +1,34 @@
 from collections import defaultdict
-import re
-from typing import List
+import json
+import os
+import threading
+from typing import List, Optional
 import nltk
-from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer
 from gensim.corpora.dictionary import Dictionary
+from gensim.corpora.mmcorpus import MmCorpus
+from gensim.corpora._mmreader import MmReader
 import pandas as pd
 from dataStructures import PostDataStructure
+from tokenizer import Tokenizer, tokenize_parallel
+from token_cache import TokenCache
 
 # nltk.download("punkt")
 # nltk.download("stopwords")
 # nltk.download("wordnet")
 
+TOKEN_CACHE_PATH = os.path.join('cache-directory', 'tokens.sqlite')
+
+# Files of a CorpusManager inside an artifact directory
+DICTIONARY_FILE = 'dictionary.dict'
+CORPUS_FILE = 'corpus.mm'
+TEXTS_FILE = 'texts.json'
+TOKENIZED_TEXTS_FILE = 'tokenized_texts.json'
+POST_IDS_FILE = 'post_ids.json'
+LAZY_ATTRIBUTES = {'texts': TEXTS_FILE, 'tokenized_texts': TOKENIZED_TEXTS_FILE, 'corpus': CORPUS_FILE,
+                   'post_ids': POST_IDS_FILE}
+
 class CorpusManager:
     _instance = None  # Singleton instance
 
@@ -23,57 +39,195 @@ class CorpusManager:
             cls._instance._initialize()
         return cls._instance
 
-    def _initialize(self):
-        """ Initializes data structures and preprocessing tools. """
+    @classmethod
+    def standalone(cls) -> 'CorpusManager':
+        """
+        A CorpusManager apart from the singleton, e.g. to load a version while another one is still being
+        read. Only the tokenizer and token cache, which don't change, are shared with the singleton.
+        """
+        corpus_manager = super(CorpusManager, cls).__new__(cls)
+        corpus_manager._initialize(shared=cls())
+        return corpus_manager
+
+    def _initialize(self, shared: Optional['CorpusManager'] = None):
+        """ Initializes data structures and preprocessing tools, reusing the tools of shared when given. """
         self.texts: List[PostDataStructure] = []  # Raw text data
         self.tokenized_texts = []  # Tokenized texts for Sentiment Analysis
+        self.post_ids: List[str] = []  # Ids of the posts whose texts are in the corpus
         self.dictionary = None
         self.corpus = None
-        self.lemmatizer = WordNetLemmatizer()
-        self.stop_words = stopwords.words("english")
-        self.words_to_rem = ['http', 'com', 'www']
+        if shared is not None:
+            self.lemmatizer, self.stop_words, self.words_to_rem = shared.lemmatizer, shared.stop_words, shared.words_to_rem
+            self.tokenizer, self.token_cache = shared.tokenizer, shared.token_cache
+        else:
+            self.lemmatizer = WordNetLemmatizer()
+            self.stop_words = stopwords.words("english")
+            self.words_to_rem = ['http', 'com', 'www']
+            self.tokenizer = Tokenizer(self.stop_words, self.words_to_rem)
+            self.token_cache = TokenCache(TOKEN_CACHE_PATH, namespace=self.tokenizer.fingerprint())  # None disables it
         self.cooccurrences = []
+        self._lazy_lock = threading.Lock()  # Serializes the lazy loads of load_artifacts' attributes
+        self.processes = 1  # Worker processes used for tokenization, None for one per CPU
+        self.parallel_threshold = 1000  # Fewer texts than this are always tokenized in-process
 
     def clean_and_tokenize(self, text):
         """ Cleans and tokenizes the given text. """
-        text = text.lower()
-
-        # Remove various alphanumeric patterns
-        text = re.sub(r'\b_+[a-z0-9]+\b', ' ', text)  # Remove patterns starting with underscore(s)
-        text = re.sub(r'\b\d+[a-z][a-z0-9_]*\b', ' ', text)  # Remove patterns like '003dl0nlraie1'
-        text = re.sub(r'\b[a-z0-9]+_[a-z0-9_]+\b', ' ', text)  # Remove patterns with underscores
-        text = re.sub(r'\b\d+s\b', ' ', text)  # Remove patterns like '000s'
-        text = re.sub(r'[^\x00-\x7F]+', ' ', text)  # Remove non-ASCII characters
-        text = re.sub(r'\b[0-9a-f]+\b', ' ', text)  # Remove hexadecimal numbers
-        text = re.sub(r'\b_*\d+\b', ' ', text)  # Remove numbers with optional leading underscores
-        text = re.sub(r'_\w+', ' ', text)  # Remove any word that starts with underscore
-        text = re.sub(r'_{1,}', ' ', text)  # Remove underscores (one or more)
-        text = re.sub(r'\W+', ' ', text)  # Remove remaining special characters
-
-        words = word_tokenize(text)
-        combined_words_to_remove = set(self.stop_words + self.words_to_rem)
-        words = [self.lemmatizer.lemmatize(word) for word in words if word not in combined_words_to_remove]  # Stopword removal & Lemmatization
+        if self.token_cache is None:
+            return self.tokenizer.tokenize(text)
+
+        words = self.token_cache.get(text)
+        if words is None:
+            words = self.tokenizer.tokenize(text)
+            self.token_cache.put(text, words)
         return words
 
-    def update_corpus(self, new_posts: List[PostDataStructure]):
-        """ Updates corpus with new text entries. """
+    def tokenize_texts(self, texts, processes=1):
+        """
+        Cleans and tokenizes many texts, reading known ones from the token cache and spreading large
+        batches of unknown ones across a process pool.
+        :param texts: Texts to tokenize.
+        :param processes: Number of worker processes, None for one per CPU and 1 to stay in-process.
+        """
+        cached = self.token_cache.get_many(texts) if self.token_cache is not None else {}
+        missing_texts = [text for i, text in enumerate(texts) if i not in cached]
+
+        if processes == 1 or len(missing_texts) < self.parallel_threshold:
+            missing_tokens = [self.tokenizer.tokenize(text) for text in missing_texts]
+        else:
+            missing_tokens = tokenize_parallel(missing_texts, self.tokenizer, processes=processes)
+        if self.token_cache is not None and missing_texts:
+            self.token_cache.put_many(missing_texts, missing_tokens)
+
+        missing_tokens = iter(missing_tokens)
+        return [cached[i] if i in cached else next(missing_tokens) for i in range(len(texts))]
+
+    def update_corpus(self, new_posts: List[PostDataStructure], incremental=True, processes=None):
+        """
+        Updates corpus with new text entries.
+        :param new_posts: Post or list of posts to add to the corpus.
+        :param incremental: Only tokenize the new texts and extend the dictionary in place. Falls back to a
+            full rebuild when the current dictionary and corpus don't match the stored texts.
+        :param processes: Worker processes used for tokenization, defaults to self.processes.
+        """
+        processes = self.processes if processes is None else processes
         new_posts = [new_posts] if not isinstance(new_posts, list) else new_posts
     
         # Handle the text extraction
-        if len(new_posts) > 1:
-            all_texts_from_new_post = []
-            for post in new_posts:
-                all_texts_from_new_post.extend([post.selftext] + post.comments)
+        all_texts_from_new_post = []
+        for post in new_posts:
+            all_texts_from_new_post.extend([post.selftext] + post.comments)
+        self.post_ids.extend(post.id for post in new_posts)
+
+        if incremental and self._is_consistent():
+            new_tokenized_texts = self.tokenize_texts(all_texts_from_new_post, processes)
+            self.texts.extend(all_texts_from_new_post)  # Store raw text
+            self.tokenized_texts.extend(new_tokenized_texts)
+            self.dictionary.add_documents(new_tokenized_texts)  # Extend Gensim dictionary in place
+            self.corpus.extend(self.dictionary.doc2bow(text) for text in new_tokenized_texts)  # Append new Bag-of-Words
         else:
-            post = new_posts[0]
-            all_texts_from_new_post = [post.selftext] + post.comments
-        
-        self.texts.extend(all_texts_from_new_post)  # Store raw text
-        self.tokenized_texts = [self.clean_and_tokenize(text) for text in self.texts]  # Preprocessed texts
+            self.texts.extend(all_texts_from_new_post)  # Store raw text
+            self.rebuild_corpus(processes)
+
+        print("\n📢 Corpus Updated Successfully!\n")
+
+    def rebuild_corpus(self, processes=1):
+        """ Re-tokenizes every stored text and rebuilds the dictionary and corpus from scratch. """
+        self.tokenized_texts = self.tokenize_texts(self.texts, processes)  # Preprocessed texts
         self.dictionary = Dictionary(self.tokenized_texts)  # Create Gensim dictionary
         self.corpus = [self.dictionary.doc2bow(text) for text in self.tokenized_texts]  # Convert to Bag-of-Words
 
-        print("\n📢 Corpus Updated Successfully!\n")
+    def _is_consistent(self):
+        """ Checks that the dictionary and corpus were built from exactly the stored texts. """
+        return (
+            self.dictionary is not None
+            and self.corpus is not None
+            and len(self.texts) == len(self.tokenized_texts) == len(self.corpus) == self.dictionary.num_docs
+        )
+
+    def verify_incremental(self):
+        """
+        Checks that the incrementally maintained state is equivalent to a full rebuild.
+        :return: List of mismatch descriptions, empty when the states are equivalent.
+        """
+        tokenized_texts = [self.clean_and_tokenize(text) for text in self.texts]
+        dictionary = Dictionary(tokenized_texts)
+        corpus = [dictionary.doc2bow(text) for text in tokenized_texts]
+
+        mismatches = []
+        if tokenized_texts != self.tokenized_texts:
+            mismatches.append("tokenized texts differ")
+        if self.dictionary is None or dictionary.token2id != self.dictionary.token2id:
+            mismatches.append("dictionary token ids differ")
+        elif (dictionary.dfs, dictionary.cfs, dictionary.num_docs, dictionary.num_pos, dictionary.num_nnz) != (
+                self.dictionary.dfs, self.dictionary.cfs, self.dictionary.num_docs, self.dictionary.num_pos,
+                self.dictionary.num_nnz):
+            mismatches.append("dictionary statistics differ")
+        if corpus != self.corpus:
+            mismatches.append("bag-of-words corpus differs")
+        return mismatches
+
+    def save_artifacts(self, directory, include_corpus=True):
+        """
+        Saves the dictionary, the bag-of-words corpus, the texts and the ids of their posts as separate files
+        of an artifact directory, so each can be loaded on its own.
+        :param include_corpus: Also save the corpus and texts. Without them, which costs O(corpus) to
+            write, the directory only serves topic inference.
+        """
+        self.dictionary.save(os.path.join(directory, DICTIONARY_FILE))
+        if not include_corpus:
+            return
+        MmCorpus.serialize(os.path.join(directory, CORPUS_FILE), self.corpus)
+        with open(os.path.join(directory, TEXTS_FILE), 'w') as f:
+            json.dump(self.texts, f)
+        with open(os.path.join(directory, TOKENIZED_TEXTS_FILE), 'w') as f:
+            json.dump(self.tokenized_texts, f)
+        with open(os.path.join(directory, POST_IDS_FILE), 'w') as f:
+            json.dump(self.post_ids, f)
+
+    def load_artifacts(self, directory):
+        """
+        Loads the dictionary saved with save_artifacts. The texts, tokenized texts, corpus and post ids are only
+        read the first time they are used, but their files are opened now: the open handles keep them readable
+        even if the directory is deleted meanwhile. Directories saved without the corpus leave them unset, and
+        so do those saved before post ids were recorded for post_ids.
+        """
+        self.dictionary = Dictionary.load(os.path.join(directory, DICTIONARY_FILE))
+        with self._lazy_lock:
+            self._close_lazy_files()
+            self._lazy_files = {}
+            for name, filename in LAZY_ATTRIBUTES.items():
+                self.__dict__.pop(name, None)  # Missing attributes go through __getattr__
+                path = os.path.join(directory, filename)
+                if os.path.isfile(path):
+                    self._lazy_files[name] = open(path, 'rb')
+
+    def close_artifacts(self):
+        """ Closes the files of attributes load_artifacts left unread; reading them raises AttributeError afterwards. """
+        with self._lazy_lock:
+            self._close_lazy_files()
+
+    def _close_lazy_files(self):
+        for handle in self.__dict__.pop('_lazy_files', {}).values():
+            handle.close()
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, i.e. the ones load_artifacts left to load lazily
+        if name not in LAZY_ATTRIBUTES or '_lazy_lock' not in self.__dict__:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        # Threads reading the same attribute at once wait for the first one to load it
+        with self._lazy_lock:
+            if name in self.__dict__:
+                return self.__dict__[name]
+            lazy_files = self.__dict__.get('_lazy_files', {})
+            if name not in lazy_files:
+                raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+            with lazy_files.pop(name) as handle:
+                if name == 'corpus':
+                    value = [[(word_id, int(count)) for word_id, count in document] for _, document in MmReader(handle)]
+                else:
+                    value = json.load(handle)
+            setattr(self, name, value)
+            return value
 
     def get_tokenized_texts(self):
         """ Returns tokenized texts for Sentiment Analysis. """
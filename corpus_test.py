@@ -0,0 +1,81 @@
+import threading
+import nltk
+import pytest
+import corpus
+from benchmarks import synthetic_texts
+from corpus import CorpusManager
+from dataStructures import to_post
+
+NLTK_DATA = ('corpora/stopwords', 'corpora/wordnet', 'tokenizers/punkt_tab')
+
+
+def _posts(num_posts, seed):
+    texts = iter(synthetic_texts(num_texts=num_posts * 4, seed=seed))
+    return [to_post({"id": f"post{seed}-{i}", "selftext": next(texts), "comments": [next(texts), next(texts), next(texts)]})
+            for i in range(num_posts)]
+
+
+@pytest.fixture
+def new_corpus_manager(tmp_path, monkeypatch):
+    for resource in NLTK_DATA:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            pytest.skip(f"NLTK data {resource} is not installed")
+    monkeypatch.setattr(corpus, 'TOKEN_CACHE_PATH', str(tmp_path / 'tokens.sqlite'))
+
+    def new_corpus_manager() -> CorpusManager:
+        corpus_manager = object.__new__(CorpusManager)  # Separate instance, not the application singleton
+        corpus_manager._initialize()
+        return corpus_manager
+    return new_corpus_manager
+
+
+def test_incremental_updates_match_a_full_rebuild(new_corpus_manager):
+    buckets = [_posts(num_posts, seed) for seed, num_posts in enumerate([40, 1, 15, 30])]
+
+    incremental = new_corpus_manager()
+    incremental.update_corpus(buckets[0], incremental=False, processes=1)
+    for bucket in buckets[1:]:
+        incremental.update_corpus(bucket, processes=1)
+    assert incremental.verify_incremental() == []
+
+    rebuilt = new_corpus_manager()
+    rebuilt.update_corpus([post for bucket in buckets for post in bucket], incremental=False, processes=1)
+    assert incremental.tokenized_texts == rebuilt.tokenized_texts
+    assert incremental.dictionary.token2id == rebuilt.dictionary.token2id
+    assert incremental.corpus == rebuilt.corpus
+
+
+def test_verify_incremental_reports_a_diverging_dictionary(new_corpus_manager):
+    corpus_manager = new_corpus_manager()
+    corpus_manager.update_corpus(_posts(10, seed=0), incremental=False, processes=1)
+    corpus_manager.dictionary.add_documents([["never", "seen", "token"]])
+    assert "dictionary token ids differ" in corpus_manager.verify_incremental()
+
+
+def test_lazy_attributes_load_once_across_threads(new_corpus_manager, tmp_path):
+    corpus_manager = new_corpus_manager()
+    corpus_manager.update_corpus(_posts(200, seed=0), incremental=False, processes=1)
+    corpus_manager.save_artifacts(str(tmp_path))
+
+    loaded = new_corpus_manager()
+    loaded.load_artifacts(str(tmp_path))
+    assert loaded.post_ids == corpus_manager.post_ids == [f"post0-{i}" for i in range(200)]
+    barrier = threading.Barrier(8)
+    results, errors = [], []
+    def read_corpus():
+        barrier.wait()
+        try:
+            results.append(loaded.corpus)
+        except AttributeError as error:
+            errors.append(error)
+    threads = [threading.Thread(target=read_corpus) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert all(result is results[0] for result in results)
+    assert results[0] == corpus_manager.corpus
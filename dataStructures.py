@@ -30,6 +30,22 @@ class PostDataStructure:
         ])
 
 
+def to_post(json_message) -> PostDataStructure:
+    """ Builds a post from a message of the Reddit queue, filling in missing fields. """
+    return PostDataStructure(
+        id=json_message.get('id', ''),
+        title=json_message.get('title', ''),
+        upvote_ratio=json_message.get('upvote_ratio', 0.0),
+        author=json_message.get('author', ''),
+        created_utc=json_message.get('created_utc', ''),
+        score=json_message.get('score', 0),
+        url=json_message.get('url', ''),
+        selftext=json_message.get('selftext', ''),
+        num_comments=json_message.get('num_comments', []),
+        comments=json_message.get('comments', [])
+    )
+
+
 
 @dataclass
 class EnhancedPostDataStructure:
@@ -46,6 +62,8 @@ class EnhancedPostDataStructure:
     sentiment_score: dict
     overall_sentiment_score: dict
     topic: dict
+    model_version: str = ''  # Training version of the LDA model the post was enriched with
+    content_hash: str = ''  # Hash of the post content the enrichment was computed from
 
     def __iter__(self):
         return iter([
@@ -61,5 +79,7 @@ class EnhancedPostDataStructure:
             self.comments,
             self.sentiment_score,
             self.overall_sentiment_score,
-            self.topic
+            self.topic,
+            self.model_version,
+            self.content_hash
         ])
\ No newline at end of file
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import time
+from typing import List, Optional
+from dataStructures import EnhancedPostDataStructure, PostDataStructure
+from gensimLDA import GensimLDA
+from mongo import WarOpMongoDB
+from vaderSentimentAnalysis import VaderSentimentAnalyzer
+
+BACKFILL_CHECKPOINT_PATH = os.path.join('cache-directory', 'enrichment_backfill.json')
+SENTIMENT_RATIO = 0.7  # Weight of the post text against its comments in the overall sentiment
+
+
+def _normalize_field(value):
+    # Posts built from queue messages fill missing fields with '', [] or 0.0 and posts read back from Mongo
+    # with None or 0, so empty values are all the same and numbers compare as floats
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value) if value else None
+    return value if value else None
+
+
+def post_content_hash(post: PostDataStructure) -> str:
+    """
+    Hash of every field of the post, so any change to it makes its enrichment stale. Fields are normalized
+    first, so a post hashes the same whether it came from the queue or from Mongo.
+    """
+    content = json.dumps([_normalize_field(value) for value in post], default=str, ensure_ascii=False)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def enrich_posts(posts: List[PostDataStructure], lda: GensimLDA, sentiment_analyzer: VaderSentimentAnalyzer,
+                 content_hashes: Optional[List[str]] = None) -> List[EnhancedPostDataStructure]:
+    """
+    Runs topic and sentiment analysis over a batch of posts, stamping each result with the training version
+    of the model and the hash of the content it was computed from. The training version only changes when
+    the model is retrained from scratch, not with each online update, which barely moves the topics.
+    :param content_hashes: Hashes of the posts when the caller already computed them.
+    """
+    model_version = lda.training_version
+    sentiments = sentiment_analyzer.analyze_posts([(post.selftext, post.comments) for post in posts], ratio=SENTIMENT_RATIO)
+    topics = lda.predict_topics([post.selftext for post in posts])
+    content_hashes = content_hashes or [post_content_hash(post) for post in posts]
+
+    return [
+        EnhancedPostDataStructure(
+            *post,
+            sentiment_score={"label": sentiment, "probs": sentiment_probs},
+            overall_sentiment_score={"label": overall_sentiment, "probs": overall_sentiment_probs},
+            topic=topic,
+            model_version=model_version,
+            content_hash=content_hash
+        )
+        for post, ((sentiment, sentiment_probs), (overall_sentiment, overall_sentiment_probs)), topic, content_hash
+        in zip(posts, sentiments, topics, content_hashes)
+    ]
+
+
+def backfill_enrichment(db: WarOpMongoDB, lda: GensimLDA, sentiment_analyzer: VaderSentimentAnalyzer, batch_size=500,
+                        checkpoint_path=BACKFILL_CHECKPOINT_PATH) -> int:
+    """
+    Re-enriches the posts whose stored enrichment is missing, comes from another training of the model, or
+    was computed from different content. Posts are scanned in id order and batches are saved as they are
+    scored; the last id done is checkpointed, so a pass interrupted by a crash resumes where it stopped
+    as long as the model wasn't retrained meanwhile.
+    :return: Number of posts re-enriched.
+    """
+    checkpoint = _load_checkpoint(checkpoint_path)
+    after_id = checkpoint.get('last_id') if checkpoint.get('training_version') == lda.training_version else None
+    if after_id is not None:
+        print(f"📢 Resuming enrichment backfill after post {after_id}")
+
+    scanned = rescored = 0
+    start = time.perf_counter()
+    for posts in db.iterPostBatches(batch_size, after_id=after_id):
+        content_hashes = [post_content_hash(post) for post in posts]
+        stamps = db.findEnrichmentStamps([post.id for post in posts])
+        stale = [i for i, (post, content_hash) in enumerate(zip(posts, content_hashes))
+                 if stamps.get(post.id) != (lda.training_version, content_hash)]
+        if stale:
+            db.saveBucketEnhancedPosts(enrich_posts([posts[i] for i in stale], lda, sentiment_analyzer,
+                                                    content_hashes=[content_hashes[i] for i in stale]))
+
+        scanned += len(posts)
+        rescored += len(stale)
+        _save_checkpoint(checkpoint_path, {'training_version': lda.training_version, 'last_id': posts[-1].id})
+        print(f"📊 Enrichment backfill: {scanned:,} posts scanned, {rescored:,} re-enriched, "
+              f"{scanned / max(time.perf_counter() - start, 1e-9):,.0f} posts/sec")
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)  # The pass is complete, the next one starts from the first post
+    print(f"✅ Enrichment backfill done: {rescored} of {scanned} posts re-enriched")
+    return rescored
+
+
+def _load_checkpoint(path) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_checkpoint(path, checkpoint):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    # Re-enrich the archive with the published model, e.g. after a retrain or a crash mid-pass
+    from artifacts import load_artifacts
+    lda, corpus_manager = load_artifacts()
+    backfill_enrichment(WarOpMongoDB(), lda, VaderSentimentAnalyzer(corpus_manager, processes=None))
@@ -0,0 +1,32 @@
+import pytest
+from dataStructures import to_post
+from enrichment import post_content_hash
+from mongo import WarOpMongoDB
+
+FULL_MESSAGE = {
+    "id": "post1", "title": "Ceasefire talks", "upvote_ratio": 1, "author": "someone", "created_utc": "2024-05-01 10:00:00",
+    "score": 42, "url": "https://reddit.com/post1", "selftext": "Talks resume today", "num_comments": 2,
+    "comments": ["Finally", "[deleted]"],
+}
+SPARSE_MESSAGE = {"id": "post2", "title": "Only a title"}
+
+
+@pytest.fixture
+def db() -> WarOpMongoDB:
+    mongomock = pytest.importorskip('mongomock')
+    db = object.__new__(WarOpMongoDB)  # Separate instance, not the application singleton
+    db.initialize(client=mongomock.MongoClient(), database='warOpMiningTest')
+    return db
+
+
+@pytest.mark.parametrize('message', [FULL_MESSAGE, SPARSE_MESSAGE], ids=['full', 'sparse'])
+def test_post_hashes_the_same_from_the_queue_and_from_mongo(db, message):
+    db.insert_new_posts([message])
+    [stored_post] = next(db.iterPostBatches())
+    assert post_content_hash(stored_post) == post_content_hash(to_post(message))
+
+
+def test_post_hash_changes_with_the_content():
+    edited_message = dict(FULL_MESSAGE, selftext="Talks resumed yesterday")
+    assert post_content_hash(to_post(edited_message)) != post_content_hash(to_post(FULL_MESSAGE))
+    assert post_content_hash(to_post(dict(FULL_MESSAGE, score=0))) != post_content_hash(to_post(FULL_MESSAGE))
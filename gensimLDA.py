@@ -1,47 +1,180 @@
+import json
+import os
+import random
+import uuid
 import gensim
 from gensim.models import CoherenceModel
+import numpy as np
 import pickle
 
+# Training backends accepted by GensimLDA
+LDA_BACKENDS = ('single', 'multicore')
+
+# Files of a GensimLDA inside an artifact directory
+LDA_MODEL_FILE = 'lda.model'  # Plus the .state and .npy files gensim saves next to it
+LDA_METADATA_FILE = 'lda.json'
+
+# Constructor arguments and training progress saved alongside the model
+LDA_PARAMS = ('num_topics', 'rebuild_oov_share', 'rebuild_growth', 'drift_tolerance', 'backend', 'workers', 'passes',
+              'chunksize', 'update_every', 'alpha', 'eta', 'random_state', 'per_word_topics')
+LDA_ONLINE_STATE = ('model_version', 'training_version', 'num_trained_docs', 'num_full_train_docs', 'num_new_tokens', 'num_oov_tokens',
+                    'baseline_perplexity')
+
 class GensimLDA:
-    def __init__(self, corpus_manager, num_topics=5):
+    def __init__(self, corpus_manager, num_topics=5, rebuild_oov_share=0.05, rebuild_growth=0.5, drift_tolerance=1.25,
+                 backend='single', workers=None, passes=10, chunksize=100, update_every=1, alpha='auto', eta=None,
+                 random_state=100, per_word_topics=True):
         """
         Initializes LDA model with a shared corpus.
         :param corpus_manager: The shared CorpusManager instance.
         :param num_topics: Number of topics for LDA.
+        :param rebuild_oov_share: Share of new tokens unknown to the model above which update_gensim
+            retrains from scratch instead of folding documents in.
+        :param rebuild_growth: Growth of the corpus since the last full training, as a fraction, above which
+            update_gensim retrains from scratch.
+        :param drift_tolerance: Ratio between the perplexity of incoming documents and the baseline above
+            which update_gensim retrains from scratch.
+        :param backend: 'single' trains a gensim LdaModel on one core, 'multicore' an LdaMulticore.
+        :param workers: Worker processes of the multicore backend, None for one less than the number of CPUs.
+        :param passes: Passes through the corpus when training.
+        :param chunksize: Documents per training chunk.
+        :param update_every: Chunks between model updates; the multicore backend always updates after
+            every batch of workers * chunksize documents.
+        :param alpha: Document-topic prior. LdaMulticore can't learn it, so 'auto' becomes 'symmetric' with
+            the multicore backend; 'asymmetric' or an explicit prior work with both.
+        :param eta: Topic-word prior.
+        :param random_state: Seed, for reproducible topics.
+        :param per_word_topics: Whether inference also returns the topics of each word.
         """
+        if backend not in LDA_BACKENDS:
+            raise ValueError(f"Unknown LDA backend {backend!r}, expected one of {LDA_BACKENDS}")
         self.corpus_manager = corpus_manager
         self.num_topics = num_topics
         self.lda_model = None
-        self.coherence_model = None
+        self.model_version = None  # Changes whenever lda_model is trained, updated or loaded
+        self.training_version = None  # Only changes when lda_model is trained from scratch or loaded from a pickle
+        self._coherence_cache = {}  # (model_version, coherence, sample_size, seed) -> score
+        self._topic_keywords = {}
+        self._topic_keywords_version = None
+        self.rebuild_oov_share = rebuild_oov_share
+        self.rebuild_growth = rebuild_growth
+        self.drift_tolerance = drift_tolerance
+        self.backend = backend
+        self.workers = workers
+        self.passes = passes
+        self.chunksize = chunksize
+        self.update_every = update_every
+        self.alpha = alpha
+        self.eta = eta
+        self.random_state = random_state
+        self.per_word_topics = per_word_topics
+        self._reset_online_state(0)
+
+    def __setstate__(self, state):
+        # Models pickled before a field existed get its default
+        self.__init__(state['corpus_manager'], state['num_topics'])
+        self.__dict__.update(state)
+        if self.model_version is None and self.lda_model is not None:
+            self._new_model_version()
+        if self.training_version is None:
+            self.training_version = self.model_version
+
+    def _reset_online_state(self, num_docs):
+        self.num_trained_docs = num_docs  # Corpus documents the model has seen
+        self.num_full_train_docs = num_docs  # Corpus size at the last full training
+        self.num_new_tokens = 0  # Tokens of documents folded in since then
+        self.num_oov_tokens = 0  # Those of them missing from the model's vocabulary
+        self.baseline_perplexity = None  # Perplexity of the first unseen batch after training
 
     def train_gensim(self):
         """ Fetch latest corpus from CorpusManager and train the LDA model. """
         dictionary, corpus = self.corpus_manager.get_gensim_data()
         if corpus and dictionary:
-            self.lda_model = gensim.models.LdaModel(
-                corpus=corpus,
-                id2word=dictionary,
-                num_topics=self.num_topics,
-                random_state=100,
-                update_every=1,
-                chunksize=100,
-                passes=10,
-                alpha='auto',
-                per_word_topics=True
-            )
-            self.coherence_model = CoherenceModel(model=self.lda_model, texts=self.corpus_manager.get_tokenized_texts(), dictionary=dictionary, coherence='c_v', processes=1)
+            self.lda_model = self._build_model(corpus, dictionary)
+            self._reset_online_state(len(corpus))
+            self._new_model_version()
+            self.training_version = self.model_version
             print("✅ LDA Model trained successfully!")
         else:
             print("⚠ No sufficient data to train LDA. Please update the corpus.")
 
+    def _new_model_version(self):
+        self.model_version = uuid.uuid4().hex
+        self._coherence_cache = {}  # Scores of older versions are never read again
+
+    def _build_model(self, corpus, dictionary):
+        common = dict(
+            corpus=corpus,
+            id2word=dictionary,
+            num_topics=self.num_topics,
+            random_state=self.random_state,
+            chunksize=self.chunksize,
+            passes=self.passes,
+            eta=self.eta,
+            per_word_topics=self.per_word_topics
+        )
+        if self.backend == 'multicore':
+            alpha = 'symmetric' if self.alpha == 'auto' else self.alpha
+            return gensim.models.LdaMulticore(workers=self.workers, alpha=alpha, **common)
+        return gensim.models.LdaModel(update_every=self.update_every, alpha=self.alpha, **common)
+
     def update_model(self, new_article):
         """
         Updates the LDA model with a new article.
         :param new_article: New text to be included in the LDA model.
         """
         new_article = self.corpus_manager.clean_and_tokenize(new_article)
-        bow_new_article = [self.corpus_manager.dictionary.doc2bow(new_article)]
+        bow_new_article = [self._known_bow(self.corpus_manager.dictionary.doc2bow(new_article))]
         self.lda_model.update(bow_new_article)
+        self._new_model_version()
+
+    def _known_bow(self, bow):
+        """ Drops words added to the dictionary after the model was trained; the model has no column for them. """
+        num_terms = self.lda_model.num_terms
+        return [(word_id, count) for word_id, count in bow if word_id < num_terms]
+
+    def update_gensim(self):
+        """
+        Folds the documents added to the corpus since the last training into the model with an online
+        update. Retrains from scratch instead when there is no model yet, when too many of the new tokens
+        are unknown to the model, when the corpus grew too much since the last full training, or when the
+        perplexity of the new documents, measured before they are folded in, drifts from the baseline.
+        """
+        dictionary, corpus = self.corpus_manager.get_gensim_data()
+        if self.lda_model is None or not corpus or self.num_trained_docs > len(corpus):
+            return self.train_gensim()
+
+        new_docs = corpus[self.num_trained_docs:]
+        if not new_docs:
+            return
+        known_docs = [self._known_bow(bow) for bow in new_docs]
+        num_tokens = sum(count for bow in new_docs for _, count in bow)
+        self.num_new_tokens += num_tokens
+        self.num_oov_tokens += num_tokens - sum(count for bow in known_docs for _, count in bow)
+
+        oov_share = self.num_oov_tokens / max(self.num_new_tokens, 1)
+        if oov_share > self.rebuild_oov_share:
+            print(f"📢 {oov_share:.1%} of new tokens are unknown to the LDA model, retraining")
+            return self.train_gensim()
+        if len(corpus) > self.num_full_train_docs * (1 + self.rebuild_growth):
+            print(f"📢 Corpus grew from {self.num_full_train_docs} to {len(corpus)} documents, retraining")
+            return self.train_gensim()
+
+        perplexity = self.get_heldout_perplexity(known_docs)
+        if np.isnan(perplexity):
+            pass  # Nothing known to the model to evaluate
+        elif self.baseline_perplexity is None:
+            self.baseline_perplexity = perplexity
+        elif perplexity > self.baseline_perplexity * self.drift_tolerance:
+            print(f"⚠ Held-out perplexity drifted from {self.baseline_perplexity:.1f} to {perplexity:.1f}, retraining")
+            return self.train_gensim()
+
+        known_docs = [bow for bow in known_docs if bow]
+        if known_docs:
+            self.lda_model.update(known_docs)
+            self._new_model_version()
+        self.num_trained_docs = len(corpus)
+        print(f"✅ LDA Model updated with {len(new_docs)} documents (perplexity {perplexity:.1f})")
 
     def get_topic_keywords(self, topic_id, num_words=5):
         try:
@@ -55,20 +188,45 @@ class GensimLDA:
             print(f"⚠ Error getting keywords for topic {topic_id}: {str(e)}")
             return []
 
+    @property
+    def topic_keywords(self):
+        """ Keywords of every topic, built once per model version. """
+        if self._topic_keywords_version != self.model_version:
+            self._topic_keywords = {topic_id: self.get_topic_keywords(topic_id) for topic_id in range(self.num_topics)}
+            self._topic_keywords_version = self.model_version
+        return self._topic_keywords
+
     def predict_topic(self, article):
         """
         Predicts the topic of a given article.
         :param article: Article to be predicted by the LDA model.
         """
-        bow_article = self.corpus_manager.dictionary.doc2bow(self.corpus_manager.clean_and_tokenize(article))
-        topic_predictions = self.lda_model[bow_article]
+        return self.predict_topics([article])[0]
+
+    def predict_topics(self, articles):
+        """
+        Predicts the dominant topic of many articles with a single inference call over their bags of words,
+        without computing per-word topics.
+        :param articles: Articles to be predicted by the LDA model.
+        :return: {"topic_id", "probability", "keywords"} for each article.
+        """
+        if not articles:
+            return []
+        dictionary = self.corpus_manager.dictionary
+        bows = [self._known_bow(dictionary.doc2bow(tokens)) for tokens in self.corpus_manager.tokenize_texts(articles)]
+        gamma, _ = self.lda_model.inference(bows)
+        topic_dists = gamma / gamma.sum(axis=1, keepdims=True)
+        topic_ids = topic_dists.argmax(axis=1)
 
-        dominant_topic = max(topic_predictions[0], key=lambda x: x[1])
-        return {
-            "topic_id": dominant_topic[0],
-            "probability": dominant_topic[1],
-            "keywords": self.get_topic_keywords(dominant_topic[0])
-        }
+        topic_keywords = self.topic_keywords
+        return [
+            {
+                "topic_id": topic_id,
+                "probability": probability,
+                "keywords": list(topic_keywords[topic_id])
+            }
+            for topic_id, probability in zip(topic_ids.tolist(), topic_dists[np.arange(len(bows)), topic_ids].tolist())
+        ]
 
     def save(self, filename):
         """ Saves the LDA model to a file. """
@@ -81,6 +239,42 @@ class GensimLDA:
             data = pickle.load(f)
             self.corpus_manager.dictionary = data['dictionary']
             self.lda_model = data['lda_model']
+            self._new_model_version()
+            self.training_version = self.model_version
+
+    def save_artifacts(self, directory):
+        """
+        Saves the model in gensim's native format, its large arrays as .npy files that can be memory-mapped,
+        with the constructor arguments and training progress in a small JSON file. The dictionary is saved
+        by the CorpusManager.
+        """
+        self.lda_model.save(os.path.join(directory, LDA_MODEL_FILE), ignore=('state', 'dispatcher', 'id2word'))
+        params = {name: getattr(self, name) for name in LDA_PARAMS}
+        for name in ('alpha', 'eta'):
+            if isinstance(params[name], np.ndarray):
+                params[name] = params[name].tolist()
+        with open(os.path.join(directory, LDA_METADATA_FILE), 'w') as f:
+            json.dump({'params': params, 'online_state': {name: getattr(self, name) for name in LDA_ONLINE_STATE}}, f)
+
+    @classmethod
+    def load_artifacts(cls, corpus_manager, directory, mmap='r'):
+        """
+        Loads a model saved with save_artifacts. Its arrays are memory-mapped, so processes loading the same
+        directory share them through the page cache.
+        :param corpus_manager: CorpusManager holding the dictionary saved in the same directory.
+        :param mmap: 'r' maps the arrays read-only, 'c' copy-on-write for processes that keep updating the
+            model, None reads them into memory.
+        """
+        with open(os.path.join(directory, LDA_METADATA_FILE)) as f:
+            metadata = json.load(f)
+        lda = cls(corpus_manager, **metadata['params'])
+        lda.lda_model = gensim.models.LdaModel.load(os.path.join(directory, LDA_MODEL_FILE), mmap=mmap)
+        lda.lda_model.id2word = corpus_manager.dictionary  # Ids the model knows are the same in the grown dictionary
+        for name, value in metadata['online_state'].items():
+            setattr(lda, name, value)
+        if lda.training_version is None:
+            lda.training_version = lda.model_version  # Saved before training versions existed
+        return lda
 
     def print_topics(self, num_words=5):
         """ Prints extracted topics from the trained LDA model. """
@@ -90,10 +284,35 @@ class GensimLDA:
         else:
             print("⚠ No trained LDA model found.")
 
-    def get_coherence(self):
-        """ Returns the coherence score of the LDA model. """
-        return self.coherence_model.get_coherence()
+    def get_coherence(self, coherence='c_v', sample_size=None, processes=1, seed=100):
+        """
+        Returns the coherence score of the LDA model. It's only computed on request, and cached until the
+        model changes.
+        :param coherence: Coherence measure, as accepted by gensim's CoherenceModel.
+        :param sample_size: Number of tokenized texts, drawn at random, the score is estimated on. None
+            uses every text.
+        :param processes: Processes computing the score, -1 for one less than the number of CPUs.
+        :param seed: Seed of the sample, so repeated calls score the same documents.
+        """
+        texts = self.corpus_manager.get_tokenized_texts()
+        if sample_size is not None and sample_size >= len(texts):
+            sample_size = None
+        key = (self.model_version, coherence, sample_size, seed if sample_size is not None else None)
+        if key not in self._coherence_cache:
+            if sample_size is not None:
+                texts = [texts[i] for i in sorted(random.Random(seed).sample(range(len(texts)), sample_size))]
+            coherence_model = CoherenceModel(model=self.lda_model, texts=texts, dictionary=self.corpus_manager.dictionary,
+                                             coherence=coherence, processes=processes)
+            self._coherence_cache[key] = coherence_model.get_coherence()
+        return self._coherence_cache[key]
 
     def get_perplexity(self):
         """ Returns the perplexity of the LDA model. """
         return self.lda_model.log_perplexity(self.corpus_manager.corpus)
+
+    def get_heldout_perplexity(self, corpus):
+        """ Returns the perplexity of the LDA model on bag-of-words documents it wasn't trained on. """
+        corpus = [bow for bow in corpus if bow]
+        if not corpus:
+            return float('nan')
+        return float(np.exp2(-self.lda_model.log_perplexity(corpus)))
@@ -1,34 +1,51 @@
+import os
 import networkx as nx
 from pyvis.network import Network
-from collections import defaultdict
 import numpy as np
+from cooccurrence import CooccurrenceMatrix
+from threshold_index import ThresholdIndex
+
+SNAPSHOT_FORMAT_VERSION = 1
+GRAPH_SNAPSHOT_PATH = 'graph_snapshot.npz'
 
 class Graph:
     def __init__(self):
-        self.G = nx.Graph()
+        self._G = nx.Graph()
         self.node_sizes = []
+        self._index = None
+
+    @property
+    def G(self) -> nx.Graph:
+        """ networkx graph, built on first use for graphs loaded from arrays or snapshots. """
+        if self._G is None:
+            self._G = self._index.to_networkx()
+        return self._G
+
+    @G.setter
+    def G(self, G):
+        self._G = G
+        self._index = None
+
+    @property
+    def index(self) -> ThresholdIndex:
+        """ Threshold index over the current edges, built on first use. """
+        if self._index is None:
+            self._index = ThresholdIndex.from_networkx(self.G)
+        return self._index
 
     def create_network_graph(self, tokenized_texts, window_size=2, min_weight=10):
         """
         Create network graph from tokenized texts
         """
-        edge_weights = defaultdict(int)
-        
-        for text in tokenized_texts:
-            for i in range(len(text)):
-                start = max(0, i - window_size)
-                end = min(len(text), i + window_size + 1)
-                
-                word1 = text[i]
-                for j in range(start, end):
-                    if i != j:
-                        word2 = text[j]
-                        edge = tuple(sorted([word1, word2]))
-                        edge_weights[edge] += 1
-        
-        for (word1, word2), weight in edge_weights.items():
-            if weight >= min_weight:
-                self.G.add_edge(word1, word2, weight=weight)
+        cooccurrences = CooccurrenceMatrix(window_size).add_documents(tokenized_texts)
+        return self.add_cooccurrences(cooccurrences, min_weight)
+
+    def add_cooccurrences(self, cooccurrences: CooccurrenceMatrix, min_weight=10):
+        """
+        Create network graph from accumulated co-occurrence weights
+        """
+        self.G.add_edges_from((word1, word2, {'weight': weight}) for word1, word2, weight in cooccurrences.edges(min_weight))
+        self._index = None
         
         # Only proceed if graph has edges
         if not self.G.edges():
@@ -47,37 +64,40 @@ class Graph:
         centrality = nx.degree_centrality(self.G)
         self.node_sizes = [v * 1000 for v in centrality.values()]
 
-    def get_max_components_num(self):
-        return len(list(nx.connected_components(self.G)))
+    def get_max_components_num(self, min_weight=None):
+        """
+        Get the number of connected components, optionally once edges below min_weight are removed.
+        """
+        if min_weight is None:
+            min_weight = np.iinfo(np.int64).min
+        return self.index.num_components(min_weight)
 
-    def get_top_components(self, n_components):
+    def get_top_components(self, n_components, min_weight=None):
         """
         Get the top N largest connected components of the graph.
         """
-        components = list(nx.connected_components(self.G))
-        components.sort(key=len, reverse=True)
-        return components[:n_components]
+        if min_weight is None:
+            min_weight = np.iinfo(np.int64).min
+        return [set(component) for component in self.index.top_components(min_weight, n_components)]
 
-    def draw_graph_pyvis(self, height="1200px", width="100%", n_components=None):
-        if not self.G.edges():
+    def draw_graph_pyvis(self, height="1200px", width="100%", n_components=None, min_weight=None):
+        """
+        Render the graph, or the top N components once edges below min_weight are removed, to HTML.
+        """
+        if min_weight is None:
+            min_weight = np.iinfo(np.int64).min
+        nodes, degrees, edges = self.index.query(min_weight, n_components)
+        if not edges:
             return "<p>No graph to display. The graph may be empty or all edges may have been filtered out.</p>"
 
         net = Network(height=height, width=width, notebook=True, cdn_resources='remote')
-        
-        # Get top components if specified
-        if n_components is not None:
-            components = self.get_top_components(n_components)
-            subgraph = self.G.subgraph(set().union(*components))
-        else:
-            subgraph = self.G
 
         # Add nodes
-        for node in subgraph.nodes():
-            size = subgraph.degree(node)  # Use degree as size
-            net.add_node(node, size=size, title=node)
+        for node, size in zip(nodes, degrees):
+            net.add_node(node, size=size, title=node)  # Use degree as size
         
         # Add edges
-        for source, target, weight in subgraph.edges(data='weight'):
+        for source, target, weight in edges:
             net.add_edge(source, target, value=weight)
         
         # Set options for better visualization
@@ -122,6 +142,7 @@ class Graph:
         
         # Remove isolated nodes
         self.G.remove_nodes_from(list(nx.isolates(self.G)))
+        self._index = None
         
         self._update_node_sizes()
         
@@ -137,6 +158,63 @@ class Graph:
             'node_sizes': self.node_sizes
         }
 
+    @classmethod
+    def from_arrays(cls, nodes, sources, targets, weights):
+        """
+        Create graph from edge arrays without building the networkx graph up front
+        """
+        graph = cls()
+        graph._G = None
+        graph._index = ThresholdIndex(nodes, sources, targets, weights)
+        degrees = graph._index.degrees()
+        scale = 1000 / (len(nodes) - 1) if len(nodes) > 1 else 1000  # Same values as degree centrality
+        graph.node_sizes = (degrees * scale).tolist()
+        return graph
+
+    @classmethod
+    def from_cooccurrences(cls, cooccurrences: CooccurrenceMatrix, min_weight=10):
+        graph = cls.from_arrays(*cooccurrences.edge_arrays(min_weight))
+        print(f"\n📊 Graph created with {len(graph.index.nodes)} nodes and {len(graph.index.weights)} edges")
+        return graph
+
+    def save_snapshot(self, path=GRAPH_SNAPSHOT_PATH):
+        """
+        Save the graph as a versioned .npz snapshot: a UTF-8 vocabulary table plus COO edge arrays.
+        The file is replaced atomically, so readers never see a partial snapshot.
+        """
+        index = self.index
+        encoded = [node.encode('utf-8') for node in index.nodes]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(node) for node in encoded], out=offsets[1:])
+        id_type = np.int32 if len(encoded) < 2 ** 31 else np.int64
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                format_version=np.array([SNAPSHOT_FORMAT_VERSION]),
+                vocabulary=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                vocabulary_offsets=offsets,
+                sources=index.sources.astype(id_type),
+                targets=index.targets.astype(id_type),
+                weights=index.weights,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_snapshot(cls, path=GRAPH_SNAPSHOT_PATH):
+        """
+        Load a graph saved with save_snapshot
+        """
+        with np.load(path) as snapshot:
+            format_version = int(snapshot['format_version'][0])
+            if format_version != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError(f"Unsupported graph snapshot format {format_version} in {path}")
+            vocabulary = snapshot['vocabulary'].tobytes()
+            offsets = snapshot['vocabulary_offsets'].tolist()
+            nodes = [vocabulary[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+            return cls.from_arrays(nodes, snapshot['sources'], snapshot['targets'], snapshot['weights'])
+
     @classmethod
     def from_graph_data(cls, graph_data):
         graph = cls()
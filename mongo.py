@@ -1,15 +1,45 @@
-from typing import List, Optional
-from pymongo import MongoClient
+import uuid
+from collections import Counter
+from dataclasses import asdict, fields
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from pymongo.database import Database
 from pymongo.collection import Collection
 from dataStructures import PostDataStructure, EnhancedPostDataStructure
 
+DUPLICATE_KEY_ERROR = 11000
+SAVE_ATTEMPTS = 5  # Saves of an enhanced post that keep losing to concurrent saves before giving up
+
+ENHANCED_POST_FIELDS = [field.name for field in fields(EnhancedPostDataStructure)]
+CARD_PROJECTION = {"comments": 0}  # Post cards don't render comment bodies
+
+def _to_bson(value):
+    """ Converts NumPy scalars (e.g. topic probabilities) nested in dicts and lists to Python types. """
+    if isinstance(value, dict):
+        return {key: _to_bson(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_bson(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _aggregate_rows(topic_id, label):
+    """ Aggregate rows a post with this topic and sentiment label counts towards, as (_id, identifying fields). """
+    return [
+        (f"topic:{topic_id}", {"kind": "topic", "topic_id": topic_id}),
+        (f"sentiment:{label}", {"kind": "sentiment", "label": label}),
+        (f"topic_sentiment:{topic_id}:{label}", {"kind": "topic_sentiment", "topic_id": topic_id, "label": label}),
+    ]
+
 class WarOpMongoDB:
-    local_storage: List[EnhancedPostDataStructure] = []
     _instance: Optional['WarOpMongoDB'] = None
     client: MongoClient
     db: Database
     collection: Collection
+    enhanced_collection: Collection
+    aggregates_collection: Collection
 
     def __new__(cls) -> 'WarOpMongoDB':
         if cls._instance is None:
@@ -17,39 +47,111 @@ class WarOpMongoDB:
             cls._instance.initialize()
         return cls._instance
 
-    def initialize(self) -> None:
-        self.client = MongoClient('mongodb://localhost:27017/')
-        self.db = self.client['warOpMiningDB']
+    def initialize(self, client: Optional[MongoClient] = None, database='warOpMiningDB') -> None:
+        self.client = client if client is not None else MongoClient('mongodb://localhost:27017/')
+        self.db = self.client[database]
         self.collection = self.db.get_collection("reddit")
+        self.enhanced_collection = self.db.get_collection("enhanced_posts")
+        self.aggregates_collection = self.db.get_collection("enhanced_post_aggregates")
+        self._enhanced_index: Optional[Dict[str, EnhancedPostDataStructure]] = None  # Loaded on first use
+        self.ensure_indexes()
+
+    def ensure_indexes(self) -> None:
+        """ Creates the indexes the queries rely on. A unique id index turns inserts into the dedup check. """
+        try:
+            self.collection.create_index([("id", ASCENDING)], unique=True, name="id_unique")
+        except OperationFailure as e:
+            print(f"⚠ Could not create unique index on id, duplicates will not be rejected: {e}")
+        self.collection.create_index([("created_utc", DESCENDING)], name="created_utc")
+        self.collection.create_index([("score", DESCENDING)], name="score")
+
+        # Keyset pagination of enhanced posts: newest first, with optional equality filters
+        self.enhanced_collection.create_index([("created_utc", DESCENDING), ("_id", DESCENDING)], name="created_utc_id")
+        self.enhanced_collection.create_index(
+            [("sentiment_score.label", ASCENDING), ("created_utc", DESCENDING), ("_id", DESCENDING)], name="sentiment_created_utc_id")
+        self.enhanced_collection.create_index(
+            [("topic.topic_id", ASCENDING), ("created_utc", DESCENDING), ("_id", DESCENDING)], name="topic_created_utc_id")
+
+    @staticmethod
+    def _to_post_document(post_data):
+        # Create a document with the necessary fields
+        return {
+            "id": post_data.get('id'),
+            "title": post_data.get('title'),
+            "selftext": post_data.get('selftext'),
+            "author": post_data.get('author'),
+            "created_utc": post_data.get('created_utc'),
+            "num_comments": post_data.get('num_comments'),
+            "score": post_data.get('score'),
+            "upvote_ratio": post_data.get('upvote_ratio'),
+            "url": post_data.get('url'),
+            "comments": post_data.get('comments', [])
+        }
 
     def insert_new_post(self, post_data):
         try:
-            # Create a document with the necessary fields
-            new_post = {
-                "id": post_data.get('id'),
-                "title": post_data.get('title'),
-                "selftext": post_data.get('selftext'),
-                "author": post_data.get('author'),
-                "created_utc": post_data.get('created_utc'),
-                "num_comments": post_data.get('num_comments'),
-                "score": post_data.get('score'),
-                "upvote_ratio": post_data.get('upvote_ratio'),
-                "url": post_data.get('url'),
-                "comments": post_data.get('comments', [])
-            }
-            result = self.collection.insert_one(new_post)
+            result = self.collection.insert_one(self._to_post_document(post_data))
             print(f"Inserted post with ID: {result.inserted_id}")
             return result.inserted_id
         except Exception as e:
             print(f"Error inserting new post: {e}")
             return None
 
-    def findPostById(self, value) -> Optional[PostDataStructure]:
-        post = self.collection.find_one({"id": value})
-        if post is None:
-            return None
+    def insert_if_new(self, post_data) -> bool:
+        """
+        Inserts a post unless its id is already stored. Returns whether it was inserted; errors other than
+        the duplicate id are raised, so a failed write is never mistaken for a duplicate.
+        """
+        try:
+            self.collection.insert_one(self._to_post_document(post_data))
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def insert_new_posts(self, posts_data) -> List[str]:
+        """
+        Inserts many posts in one unordered bulk insert and returns the ids of the inserted ones.
+        Posts whose id is already stored are rejected by the unique index and skipped; any other write
+        error is raised.
+        """
+        if not posts_data:
+            return []
+        documents = [self._to_post_document(post_data) for post_data in posts_data]
+        failed = set()
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != DUPLICATE_KEY_ERROR for error in errors) or e.details.get('writeConcernErrors'):
+                raise
+            failed = {error['index'] for error in errors}
+        inserted = [document['id'] for i, document in enumerate(documents) if i not in failed]
+        print(f"Inserted {len(inserted)} posts")
+        return inserted
+
+    def findExistingPostIds(self, ids) -> Set[str]:
+        """ Returns which of the given post ids are already stored, in a single query. """
+        if not ids:
+            return set()
+        return {post['id'] for post in self.collection.find({"id": {"$in": list(ids)}}, {"id": 1, "_id": 0})}
+
+    def findAllPostIds(self) -> Set[str]:
+        """ Returns the id of every stored post, projecting nothing else. """
+        return {post['id'] for post in self.collection.find({}, {"id": 1, "_id": 0})}
+
+    def findPostsByIds(self, ids, batch_size=500) -> List[PostDataStructure]:
+        """ Returns the stored posts with the given ids, in id order, querying batch_size ids at a time. """
+        ids = sorted(ids)
+        posts = []
+        for start in range(0, len(ids), batch_size):
+            documents = self.collection.find({"id": {"$in": ids[start:start + batch_size]}}).sort("id", ASCENDING)
+            posts.extend(self._from_post_document(document) for document in documents)
+        return posts
+
+    @staticmethod
+    def _from_post_document(post) -> PostDataStructure:
         return PostDataStructure(
-            id=post.get('id', ''),  # Changed from '_id' to 'id'
+            id=post.get('id', str(post.get('_id', ''))),
             title=post.get('title', ''),
             upvote_ratio=post.get('upvote_ratio', 0.0),
             author=post.get('author', None),
@@ -61,43 +163,244 @@ class WarOpMongoDB:
             comments=post.get('comments', [])
         )
 
+    def findPostById(self, value) -> Optional[PostDataStructure]:
+        post = self.collection.find_one({"id": value})
+        if post is None:
+            return None
+        return self._from_post_document(post)
+
     def findAllPosts(self) -> List[PostDataStructure]:
-        posts = self.collection.find()
-        return [
-            PostDataStructure(
-                id=post.get('_id', ''),
-                title=post.get('title', ''),
-                upvote_ratio=post.get('upvote_ratio', 0.0),
-                author=post.get('author', None),
-                created_utc=post.get('created_utc', 0),
-                score=post.get('score', 0),
-                url=post.get('url', ''),
-                selftext=post.get('selftext', ''),
-                num_comments=post.get('num_comments', 0),
-                comments=post.get('comments', [])
-            ) for post in posts
-        ]
-
-    def findEnhancedPostById(self, postId):
-        return next((x for x in self.local_storage if x.id == postId), None)
-
-    def getAllEnhancedPost(self):
-        return self.local_storage
+        return [self._from_post_document(post) for post in self.collection.find()]
 
-    def saveEnhancedPost(self, post: EnhancedPostDataStructure):
-        existing_post = self.findEnhancedPostById(post.id)
-        if existing_post is None:
-            self.local_storage.append(post)
-        else:
-            # Replace the existing post with the new one
-            index = self.local_storage.index(existing_post)
-            self.local_storage[index] = post
+    def iterPostBatches(self, batch_size=500, after_id: Optional[str] = None):
+        """
+        Yields every post in batches, in id order, through the unique index on id.
+        :param after_id: Only yield posts whose id comes after this one, to resume an interrupted pass.
+        """
+        query = {"id": {"$gt": after_id}} if after_id is not None else {}
+        batch = []
+        for post in self.collection.find(query).sort("id", ASCENDING).batch_size(batch_size):
+            batch.append(self._from_post_document(post))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def findEnrichmentStamps(self, ids) -> Dict[str, Tuple[str, str]]:
+        """ Returns the (model_version, content_hash) each of the given posts was enriched with. """
+        documents = self.enhanced_collection.find({"_id": {"$in": list(ids)}}, {"model_version": 1, "content_hash": 1})
+        return {document["_id"]: (document.get("model_version", ""), document.get("content_hash", "")) for document in documents}
+
+    @staticmethod
+    def _to_enhanced_document(post: EnhancedPostDataStructure):
+        document = _to_bson(asdict(post))
+        document['_id'] = post.id
+        return document
+
+    @staticmethod
+    def _from_enhanced_document(document) -> EnhancedPostDataStructure:
+        defaults = {"comments": [], "selftext": "", "sentiment_score": {}, "overall_sentiment_score": {}, "topic": {},
+                    "model_version": "", "content_hash": ""}
+        return EnhancedPostDataStructure(**{name: document.get(name, defaults.get(name)) for name in ENHANCED_POST_FIELDS})
+
+    @property
+    def enhanced_index(self) -> Dict[str, EnhancedPostDataStructure]:
+        """ In-memory view of the enhanced_posts collection keyed by post id. """
+        if self._enhanced_index is None:
+            self._enhanced_index = {
+                document['_id']: self._from_enhanced_document(document) for document in self.enhanced_collection.find()
+            }
+        return self._enhanced_index
+
+    def refreshEnhancedPosts(self):
+        """ Drops the in-memory index so the next read picks up posts saved by other processes. """
+        self._enhanced_index = None
+
+    def findEnhancedPostById(self, postId) -> Optional[EnhancedPostDataStructure]:
+        return self.enhanced_index.get(postId)
+
+    def getAllEnhancedPost(self) -> List[EnhancedPostDataStructure]:
+        return list(self.enhanced_index.values())
+
+    def countEnhancedPosts(self) -> int:
+        """ Number of enhanced posts, read from the collection metadata instead of counting documents. """
+        return self.enhanced_collection.estimated_document_count()
+
+    def findEnhancedPostsPage(self, limit=20, after: Optional[Tuple[str, str]] = None, sentiment: Optional[str] = None,
+                              topic_id: Optional[int] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                              projection=CARD_PROJECTION) -> Tuple[List[EnhancedPostDataStructure], Optional[Tuple[str, str]]]:
+        """
+        Returns one page of enhanced posts, newest first, filtered and projected on the server.
+        :param limit: Maximum number of posts in the page.
+        :param after: Cursor returned with the previous page, None for the first page.
+        :param sentiment: Only posts with this sentiment label.
+        :param topic_id: Only posts with this dominant topic.
+        :param date_from: Only posts created at or after this "%Y-%m-%d %H:%M:%S" timestamp.
+        :param date_to: Only posts created at or before this "%Y-%m-%d %H:%M:%S" timestamp.
+        :param projection: Mongo projection, comments are left out by default.
+        :return: (posts, cursor of the next page or None when this is the last page)
+        """
+        conditions = []
+        if sentiment is not None:
+            conditions.append({"sentiment_score.label": sentiment})
+        if topic_id is not None:
+            conditions.append({"topic.topic_id": topic_id})
+        if date_from is not None:
+            conditions.append({"created_utc": {"$gte": date_from}})
+        if date_to is not None:
+            conditions.append({"created_utc": {"$lte": date_to}})
+        if after is not None:
+            created_utc, post_id = after
+            conditions.append({"$or": [
+                {"created_utc": {"$lt": created_utc}},
+                {"created_utc": created_utc, "_id": {"$lt": post_id}},
+            ]})
+        query = {"$and": conditions} if conditions else {}
+
+        documents = list(
+            self.enhanced_collection.find(query, projection)
+            .sort([("created_utc", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)  # One extra document tells whether another page follows
+        )
+        posts = [self._from_enhanced_document(document) for document in documents[:limit]]
+        next_cursor = (documents[limit - 1]["created_utc"], documents[limit - 1]["_id"]) if len(documents) > limit else None
+        return posts, next_cursor
 
-        print(f"Local Storage updated. Total posts: {len(self.local_storage)}")
+    def saveEnhancedPost(self, post: EnhancedPostDataStructure):
+        self.saveBucketEnhancedPosts([post])
         return None
     
     def saveBucketEnhancedPosts(self, posts: List[EnhancedPostDataStructure]):
+        """
+        Upserts enhanced posts with one unordered bulk write and updates the in-memory index if it is loaded.
+        Every stored document carries a revision, and each replace only matches the revision read just
+        before it, so the aggregate counts move from exactly the document that was replaced. A post another
+        process saved in between fails with a duplicate key error instead and is saved again from its new
+        revision, at most SAVE_ATTEMPTS times.
+        """
+        if not posts:
+            return
+        posts = list({post.id: post for post in posts}.values())  # Last copy of repeated ids wins
+        saved = 0
+        for attempt in range(SAVE_ATTEMPTS):
+            documents = self.enhanced_collection.find(
+                {"_id": {"$in": [post.id for post in posts]}}, {"revision": 1, "topic.topic_id": 1, "sentiment_score.label": 1})
+            previous = {document['_id']: document for document in documents}
+            operations = []
+            for post in posts:
+                document = dict(self._to_enhanced_document(post), revision=uuid.uuid4().hex)
+                # A missing revision also matches documents saved before revisions existed
+                revision = previous[post.id].get("revision") if post.id in previous else None
+                operations.append(ReplaceOne({"_id": post.id, "revision": revision}, document, upsert=True))
+
+            error, failed = None, {}
+            try:
+                self.enhanced_collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                error, failed = e, {write_error['index']: write_error for write_error in e.details.get('writeErrors', [])}
+
+            replaced = [post for i, post in enumerate(posts) if i not in failed]
+            self._update_aggregates([previous[post.id] for post in replaced if post.id in previous], replaced)
+            if self._enhanced_index is not None:  # Kept current once loaded, but never loaded just to be updated
+                for post in replaced:
+                    self._enhanced_index[post.id] = post
+            saved += len(replaced)
+
+            if error is not None and (any(write_error.get('code') != DUPLICATE_KEY_ERROR for write_error in failed.values())
+                                      or error.details.get('writeConcernErrors')):
+                raise error
+            posts = [post for i, post in enumerate(posts) if i in failed]  # Changed since they were read
+            if not posts:
+                break
+        else:
+            raise error
+
+        print(f"Enhanced posts updated: {saved} saved.")
+
+    def _update_aggregates(self, previous_documents, posts: List[EnhancedPostDataStructure]):
+        """
+        Moves the counts of replaced posts to their new topic and sentiment. Only deltas are written, with
+        $inc, so updates from several processes add up instead of overwriting each other.
+        """
+        deltas = Counter()
+        identifying_fields = {}
+        keywords = {}
+        for document in previous_documents:
+            rows = _aggregate_rows(document.get("topic", {}).get("topic_id"), document.get("sentiment_score", {}).get("label"))
+            for key, row_fields in rows:
+                deltas[key] -= 1
+                identifying_fields[key] = row_fields
         for post in posts:
-            self.saveBucketEnhancedPosts(post)
+            topic_id = _to_bson(post.topic.get("topic_id"))
+            for key, row_fields in _aggregate_rows(topic_id, post.sentiment_score.get("label")):
+                deltas[key] += 1
+                identifying_fields[key] = row_fields
+            keywords[f"topic:{topic_id}"] = post.topic.get("keywords", [])
+
+        updates = []
+        for key, row_fields in identifying_fields.items():
+            if deltas[key] == 0 and key not in keywords:
+                continue
+            fields_to_set = dict(row_fields, **({"keywords": keywords[key]} if key in keywords else {}))
+            updates.append(UpdateOne({"_id": key}, {"$inc": {"count": deltas[key]}, "$set": fields_to_set}, upsert=True))
+        if updates:
+            self.aggregates_collection.bulk_write(updates, ordered=False)
+
+    @staticmethod
+    def _fold_aggregates(rows):
+        aggregates = {"topics": {}, "keywords": {}, "sentiments": {}, "topic_sentiments": {}}
+        for row in rows:
+            if row.get("count", 0) <= 0:
+                continue
+            if row["kind"] == "topic":
+                aggregates["topics"][row["topic_id"]] = row["count"]
+                aggregates["keywords"][row["topic_id"]] = row.get("keywords", [])
+            elif row["kind"] == "sentiment":
+                aggregates["sentiments"][row["label"]] = row["count"]
+            elif row["kind"] == "topic_sentiment":
+                aggregates["topic_sentiments"][(row["topic_id"], row["label"])] = row["count"]
+        return aggregates
+
+    def getAggregates(self):
+        """
+        Returns the materialized counts of enhanced posts per topic, per sentiment label and per
+        (topic, sentiment label), plus the latest keywords of each topic.
+        """
+        return self._fold_aggregates(self.aggregates_collection.find())
+
+    def _computeAggregateRows(self):
+        groups = self.enhanced_collection.aggregate([
+            {"$group": {
+                "_id": {"topic_id": "$topic.topic_id", "label": "$sentiment_score.label"},
+                "count": {"$sum": 1},
+                "keywords": {"$last": "$topic.keywords"},
+            }}
+        ])
+        counts = Counter()
+        identifying_fields = {}
+        keywords = {}
+        for group in groups:
+            topic_id, label = group["_id"].get("topic_id"), group["_id"].get("label")
+            for key, row_fields in _aggregate_rows(topic_id, label):
+                counts[key] += group["count"]
+                identifying_fields[key] = row_fields
+            keywords[topic_id] = group.get("keywords") or []
+
+        rows = [dict(row_fields, _id=key, count=counts[key]) for key, row_fields in identifying_fields.items()]
+        for row in rows:
+            if row["kind"] == "topic":
+                row["keywords"] = keywords[row["topic_id"]]
+        return rows
+
+    def computeAggregates(self):
+        """ Computes the same counts as getAggregates with an aggregation pipeline over enhanced_posts. """
+        return self._fold_aggregates(self._computeAggregateRows())
 
-        
\ No newline at end of file
+    def rebuildAggregates(self):
+        """ Recomputes the materialized counts from scratch, e.g. after a backfill. """
+        rows = self._computeAggregateRows()
+        self.aggregates_collection.delete_many({})
+        if rows:
+            self.aggregates_collection.insert_many(rows)
+        return self._fold_aggregates(rows)
@@ -0,0 +1,127 @@
+import os
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, ServerSelectionTimeoutError
+from dataStructures import EnhancedPostDataStructure
+from mongo import WarOpMongoDB
+
+MONGO_TEST_URI = os.environ.get('MONGO_TEST_URI', 'mongodb://localhost:27017/')
+TEST_DATABASE = 'warOpMiningTest'
+
+
+def _open_db(client) -> WarOpMongoDB:
+    client.drop_database(TEST_DATABASE)
+    db = object.__new__(WarOpMongoDB)  # Separate instance, not the application singleton
+    db.initialize(client=client, database=TEST_DATABASE)
+    return db
+
+
+@pytest.fixture
+def mongod_db():
+    client = MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command('ping')
+    except ServerSelectionTimeoutError:
+        pytest.skip(f"No mongod at {MONGO_TEST_URI}")
+    yield _open_db(client)
+    client.drop_database(TEST_DATABASE)
+
+
+@pytest.fixture
+def mongomock_db():
+    mongomock = pytest.importorskip('mongomock')
+    return _open_db(mongomock.MongoClient())
+
+
+@pytest.fixture(params=['mongod_db', 'mongomock_db'])
+def db(request) -> WarOpMongoDB:
+    return request.getfixturevalue(request.param)
+
+
+def _enhanced_post(post_id, topic_id=0, label='positive') -> EnhancedPostDataStructure:
+    return EnhancedPostDataStructure(
+        id=post_id, title="", upvote_ratio=1.0, author="", created_utc="2024-05-01 10:00:00", score=0, url="",
+        selftext="", num_comments=0, comments=[], sentiment_score={"label": label}, overall_sentiment_score={},
+        topic={"topic_id": topic_id, "keywords": ["war"]})
+
+
+def _find_stages(plan, stage):
+    """ Every stage of the given type in an explain plan, whatever the server version nests them in. """
+    if isinstance(plan, dict):
+        found = [plan] if plan.get('stage') == stage else []
+        return found + [match for value in plan.values() for match in _find_stages(value, stage)]
+    if isinstance(plan, list):
+        return [match for value in plan for match in _find_stages(value, stage)]
+    return []
+
+
+def test_insert_if_new_rejects_duplicates(db):
+    assert db.insert_if_new({"id": "post1", "title": "first"})
+    assert not db.insert_if_new({"id": "post1", "title": "second"})
+    assert db.collection.count_documents({"id": "post1"}) == 1
+    assert db.findPostById("post1").title == "first"
+
+
+def test_insert_new_posts_returns_only_inserted_ids(db):
+    assert db.insert_new_posts([{"id": "post1"}, {"id": "post2"}]) == ["post1", "post2"]
+    assert db.insert_new_posts([{"id": "post2"}, {"id": "post3"}, {"id": "post1"}]) == ["post3"]
+    assert db.collection.count_documents({}) == 3
+
+
+def test_find_posts_missing_from_a_corpus(db):
+    db.insert_new_posts([{"id": f"post{i}", "title": str(i)} for i in range(5)])
+    assert db.findAllPostIds() == {f"post{i}" for i in range(5)}
+    posts = db.findPostsByIds({"post3", "post1", "unknown"}, batch_size=1)
+    assert [(post.id, post.title) for post in posts] == [("post1", "1"), ("post3", "3")]
+
+
+def test_insert_if_new_raises_write_errors(mongomock_db, monkeypatch):
+    def insert_one(document):
+        raise AutoReconnect("connection lost")
+    monkeypatch.setattr(mongomock_db.collection, 'insert_one', insert_one)
+    with pytest.raises(AutoReconnect):
+        mongomock_db.insert_if_new({"id": "post1"})
+
+
+def test_dedup_lookup_uses_the_unique_id_index(mongod_db):
+    assert mongod_db.collection.index_information()["id_unique"]["unique"]
+    mongod_db.collection.insert_many([{"id": f"post{i}", "title": "", "comments": []} for i in range(10_000)])
+
+    explain = mongod_db.collection.find({"id": "post5000"}).explain()
+    scans = _find_stages(explain["queryPlanner"]["winningPlan"], "IXSCAN")
+    assert [scan["indexName"] for scan in scans] == ["id_unique"]
+    assert not _find_stages(explain["queryPlanner"]["winningPlan"], "COLLSCAN")
+    # One key and one document examined whatever the size of the collection
+    assert explain["executionStats"]["totalKeysExamined"] <= 1
+    assert explain["executionStats"]["totalDocsExamined"] <= 1
+
+
+def test_saving_enhanced_posts_only_updates_a_loaded_index(mongod_db):
+    mongod_db.saveBucketEnhancedPosts([_enhanced_post("post1")])
+    assert mongod_db._enhanced_index is None
+    assert mongod_db.countEnhancedPosts() == 1
+
+    assert mongod_db.findEnhancedPostById("post1") is not None  # Loads the index
+    mongod_db.saveBucketEnhancedPosts([_enhanced_post("post2")])
+    assert set(mongod_db._enhanced_index) == {"post1", "post2"}
+
+
+def test_concurrent_saves_keep_the_aggregates_exact(mongod_db, monkeypatch):
+    other_process = object.__new__(WarOpMongoDB)
+    other_process.initialize(client=mongod_db.client, database=TEST_DATABASE)
+    mongod_db.saveBucketEnhancedPosts([_enhanced_post("post1", topic_id=0), _enhanced_post("post2", topic_id=0)])
+
+    bulk_write = mongod_db.enhanced_collection.bulk_write
+    def bulk_write_after_another_save(operations, **kwargs):
+        monkeypatch.setattr(mongod_db.enhanced_collection, 'bulk_write', bulk_write)
+        other_process.saveBucketEnhancedPosts([_enhanced_post("post1", topic_id=1, label='negative')])
+        return bulk_write(operations, **kwargs)
+    monkeypatch.setattr(mongod_db.enhanced_collection, 'bulk_write', bulk_write_after_another_save)
+
+    # post1 changed between the read of its revision and the write, post2 didn't
+    mongod_db.saveBucketEnhancedPosts([_enhanced_post("post1", topic_id=2), _enhanced_post("post2", topic_id=2)])
+    assert mongod_db.findEnhancedPostById("post1").topic["topic_id"] == 2
+    aggregates = mongod_db.getAggregates()
+    assert aggregates["topics"] == {2: 2}
+    assert aggregates["sentiments"] == {"positive": 2}
+    assert aggregates == mongod_db.computeAggregates()
@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+
+class Pipeline:
+    def __init__(self, stages: List[Tuple[Callable, int]]):
+        """
+        Runs items through a sequence of stages, each on its own bounded thread pool. A stage with a
+        single worker processes items one at a time, in the order they reach it; after a stage with
+        several workers that is the order they finish in, not the order items were submitted.
+        :param stages: (function, number of workers) pairs. Each function receives the previous
+            stage's result.
+        """
+        self._stages = [function for function, _ in stages]
+        self._executors = [
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix=function.__name__)
+            for function, workers in stages
+        ]
+
+    def submit(self, item, on_done: Callable[[Optional[BaseException]], None]):
+        """
+        Queues an item on the first stage. on_done is called from a worker thread with None once the
+        last stage finished, or with the exception of the stage that failed.
+        """
+        self._run(0, item, on_done)
+
+    def _run(self, stage, item, on_done):
+        future = self._executors[stage].submit(self._stages[stage], item)
+        future.add_done_callback(lambda future: self._advance(stage, future, on_done))
+
+    def _advance(self, stage, future: Future, on_done):
+        error = future.exception()
+        if error is not None or stage + 1 == len(self._stages):
+            on_done(error)
+        else:
+            self._run(stage + 1, future.result(), on_done)
+
+    def shutdown(self):
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+
+
+class ReadWriteLock:
+    def __init__(self):
+        """
+        Lets any number of readers hold the lock at once, or a single writer. Waiting writers keep new
+        readers out, so a steady stream of reads can't starve an update.
+        """
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._waiting_writers += 1
+            self._condition.wait_for(lambda: not self._writing and not self._readers)
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+# Slider positions rendered ahead of time whenever a new graph version is published
+COMMON_MIN_WEIGHTS = (100, 150, 200, 300, 500, 1000)
+
+
+class GraphRenderCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        LRU cache of rendered graph HTML keyed by (graph version, min_weight, n_components).
+        :param max_bytes: Total size of cached HTML above which the least recently used pages are evicted.
+        """
+        self.max_bytes = max_bytes
+        self._pages: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._published_version = None
+
+    def get(self, version, min_weight, n_components=None) -> Optional[str]:
+        key = (version, min_weight, n_components)
+        with self._lock:
+            html = self._pages.get(key)
+            if html is not None:
+                self._pages.move_to_end(key)
+            return html
+
+    def put(self, version, min_weight, n_components, html: str):
+        key = (version, min_weight, n_components)
+        size = len(html.encode('utf-8'))
+        with self._lock:
+            if key in self._pages:
+                self._size -= len(self._pages.pop(key).encode('utf-8'))
+            self._pages[key] = html
+            self._size += size
+            while self._size > self.max_bytes and len(self._pages) > 1:
+                _, evicted = self._pages.popitem(last=False)
+                self._size -= len(evicted.encode('utf-8'))
+
+    def get_or_render(self, graph, version, min_weight, n_components=None) -> str:
+        html = self.get(version, min_weight, n_components)
+        if html is None:
+            html = graph.draw_graph_pyvis(n_components=n_components, min_weight=min_weight)
+            self.put(version, min_weight, n_components, html)
+        return html
+
+    def publish(self, graph, version, min_weights: Iterable[int] = COMMON_MIN_WEIGHTS):
+        """
+        Drops pages of older graph versions and renders the common slider positions of the new one
+        in the background. Publishing the current version again does nothing.
+        """
+        with self._lock:
+            if version == self._published_version:
+                return
+            self._published_version = version
+            for key in [key for key in self._pages if key[0] != version]:
+                self._size -= len(self._pages.pop(key).encode('utf-8'))
+
+        # The components slider defaults to every component at the chosen weight
+        positions = [(min_weight, max(graph.get_max_components_num(min_weight), 1)) for min_weight in min_weights]
+        threading.Thread(target=self._precompute, args=(graph, version, positions), daemon=True).start()
+
+    def _precompute(self, graph, version, positions: Iterable[Tuple[int, int]]):
+        for min_weight, n_components in positions:
+            if self._published_version != version:
+                return  # A newer graph was published meanwhile
+            self.get_or_render(graph, version, min_weight, n_components)
+
+    def __len__(self):
+        return len(self._pages)
@@ -1,23 +1,140 @@
+import ctypes
 import json
 import os
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where writers aren't serialized
+    fcntl = None
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.inotify_init1, _libc.inotify_add_watch  # Linux only
+except (AttributeError, OSError, TypeError):  # Elsewhere wait_for_version falls back to polling
+    _libc = None
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
 
 STATE_FILE = 'shared_state.json'
+LOCK_FILE = f"{STATE_FILE}.lock"
+
+_cache_lock = threading.Lock()
+_cached_stat = None  # (st_mtime_ns, st_ino, st_size) of the file _cached_state was parsed from
+_cached_state = {}
+
+def _stat_key():
+    try:
+        stat = os.stat(STATE_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
 
 def save_state(state):
-    with open(STATE_FILE, 'w') as f:
+    """ Replaces the state file atomically: readers see either the old or the new state, never a partial one. """
+    tmp_path = f"{STATE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
         json.dump(state, f)
+    os.replace(tmp_path, STATE_FILE)
 
 def load_state():
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    """ Returns the state, only parsing the file again when its mtime, inode or size changed. """
+    global _cached_stat, _cached_state
+    key = _stat_key()
+    with _cache_lock:
+        if key != _cached_stat:
+            state = {}
+            if key is not None:
+                try:
+                    with open(STATE_FILE, 'r') as f:
+                        state = json.load(f)
+                except FileNotFoundError:
+                    key = None
+            _cached_stat, _cached_state = key, state
+        return dict(_cached_state)
+
+@contextmanager
+def _locked():
+    """ Serializes read-modify-write cycles across processes. """
+    if fcntl is None:
+        yield
+        return
+    with open(LOCK_FILE, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
 
 def update_state(key, value):
-    state = load_state()
-    state[key] = value
-    save_state(state)
+    with _locked():
+        state = load_state()
+        state[key] = value
+        save_state(state)
+
+def bump_version(**fields):
+    """
+    Increments the version and sets the given fields in a single atomic write.
+    :return: The new version.
+    """
+    with _locked():
+        state = load_state()
+        state.update(fields)
+        state['version'] = state.get('version', 0) + 1
+        save_state(state)
+    return state['version']
 
 def get_state_version():
     state = load_state()
     return state.get('version', 0)
+
+def _watch_state_file():
+    """
+    Returns an inotify descriptor that becomes readable when a file in the state file's directory is written
+    or renamed into it, which save_state does with os.replace. None where inotify isn't available.
+    """
+    if _libc is None:
+        return None
+    fd = _libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        return None
+    directory = os.path.dirname(os.path.abspath(STATE_FILE))
+    if _libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def wait_for_version(min_version, timeout=None, poll_interval=0.2):
+    """
+    Blocks until the version reaches min_version. On Linux the wait sleeps on an inotify watch of the
+    state file's directory and only wakes up when a file in it changes; elsewhere it stats the file every
+    poll_interval seconds. The file is only parsed once it changed.
+    :param timeout: Seconds to wait at most, None to wait forever.
+    :return: The current version, or None if the timeout expired first.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    watch = _watch_state_file()  # Watching before the first check, so a bump in between isn't missed
+    try:
+        last_key = object()
+        while True:
+            key = _stat_key()
+            if key != last_key:
+                last_key = key
+                version = get_state_version()
+                if version >= min_version:
+                    return version
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            if watch is None:
+                time.sleep(poll_interval if remaining is None else min(poll_interval, remaining))
+            elif select.select([watch], [], [], remaining)[0]:
+                os.read(watch, 64 * 1024)  # Drain the events, the stat above tells what changed
+    finally:
+        if watch is not None:
+            os.close(watch)
@@ -1,15 +1,14 @@
 import streamlit as st
-import pickle
 from graph import Graph
+from artifacts import load_artifacts
 from mongo import WarOpMongoDB
 from pyvis.network import Network
 import pandas as pd
 import plotly.express as px
 import streamlit.components.v1 as components
 
-# Load the trained LDA model and corpus_manager
-with open('trained_lda_model.pkl', 'rb') as f:
-    lda, corpus_manager = pickle.load(f)
+# Load the published LDA model and corpus_manager, from a version with the corpus since the graph is built from it
+lda, corpus_manager = load_artifacts(require_corpus=True)
 
 # Initialize MongoDB connection
 db = WarOpMongoDB()
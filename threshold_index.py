@@ -0,0 +1,192 @@
+from typing import Dict, List, Tuple
+import networkx as nx
+import numpy as np
+
+
+class ThresholdIndex:
+    def __init__(self, nodes: List[str], sources, targets, weights):
+        """
+        Precomputed index answering (min_weight, n_components) queries without building a graph.
+        Edges are sorted by weight, so the edges above a threshold are a prefix found by binary
+        search. A union-find sweep from the heaviest edge down records every merge in a merge
+        tree: the connected components at any threshold are the tree nodes whose own weight
+        reaches the threshold while their parent's doesn't, and the leaves of each tree node
+        occupy a contiguous range of leaf_order.
+        :param nodes: Node labels, indexed by the ids used in sources and targets.
+        :param sources: Source node id of each edge.
+        :param targets: Target node id of each edge.
+        :param weights: Weight of each edge.
+        """
+        self.nodes = list(nodes)
+        weights = np.asarray(weights, dtype=np.int64)
+        order = np.argsort(-weights, kind='stable')
+        self.sources = np.asarray(sources, dtype=np.int64)[order]
+        self.targets = np.asarray(targets, dtype=np.int64)[order]
+        self.weights = weights[order]  # Descending
+        self._components_cache: Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._build()
+
+    @classmethod
+    def from_networkx(cls, G):
+        nodes = list(G.nodes())
+        node_ids = {node: i for i, node in enumerate(nodes)}
+        edges = [(node_ids[u], node_ids[v], weight) for u, v, weight in G.edges(data='weight')]
+        sources, targets, weights = zip(*edges) if edges else ((), (), ())
+        return cls(nodes, sources, targets, weights)
+
+    def to_networkx(self) -> nx.Graph:
+        G = nx.Graph()
+        G.add_nodes_from(self.nodes)
+        nodes = self.nodes
+        G.add_weighted_edges_from(
+            (nodes[u], nodes[v], weight) for u, v, weight in zip(self.sources.tolist(), self.targets.tolist(), self.weights.tolist()))
+        return G
+
+    def degrees(self) -> np.ndarray:
+        """ Degree of every node over all edges, self-loops counting twice like networkx. """
+        num_nodes = len(self.nodes)
+        return np.bincount(self.sources, minlength=num_nodes) + np.bincount(self.targets, minlength=num_nodes)
+
+    def _build(self):
+        num_nodes = len(self.nodes)
+
+        # A node appears once its heaviest edge is above the threshold
+        activation = np.zeros(num_nodes, dtype=np.int64)
+        np.maximum.at(activation, self.sources, self.weights)
+        np.maximum.at(activation, self.targets, self.weights)
+        self._has_edges = np.zeros(num_nodes, dtype=bool)
+        self._has_edges[self.sources] = True
+        self._has_edges[self.targets] = True
+
+        # Union-find sweep over edges from heaviest to lightest, recording the merge tree.
+        # Tree nodes 0..num_nodes-1 are the graph nodes, every merge appends a new tree node.
+        parent = list(range(num_nodes))
+        tree_root = list(range(num_nodes))  # Union-find root -> tree node of its component
+        tree_weight = activation.tolist()
+        tree_size = [1] * num_nodes
+        children = [None] * num_nodes
+        tree_parent = [-1] * num_nodes
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for u, v, weight in zip(self.sources.tolist(), self.targets.tolist(), self.weights.tolist()):
+            root_u, root_v = find(u), find(v)
+            if root_u == root_v:
+                continue
+            left, right = tree_root[root_u], tree_root[root_v]
+            merged = len(tree_weight)
+            tree_weight.append(weight)
+            tree_size.append(tree_size[left] + tree_size[right])
+            children.append((left, right))
+            tree_parent.append(-1)
+            tree_parent[left] = tree_parent[right] = merged
+            parent[root_v] = root_u
+            tree_root[root_u] = merged
+
+        # Lay the leaves out so that every tree node covers a contiguous range
+        num_tree = len(tree_weight)
+        lo = [0] * num_tree
+        hi = [0] * num_tree
+        leaf_order = []
+        for root in range(num_tree):
+            if tree_parent[root] != -1:
+                continue
+            stack = [(root, False)]
+            while stack:
+                node, done = stack.pop()
+                if done:
+                    hi[node] = len(leaf_order)
+                    continue
+                lo[node] = len(leaf_order)
+                if children[node] is None:
+                    leaf_order.append(node)
+                    hi[node] = len(leaf_order)
+                else:
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in reversed(children[node]))
+
+        self.tree_weight = np.array(tree_weight, dtype=np.int64)
+        self.tree_parent_weight = np.array(
+            [tree_weight[p] if p != -1 else np.iinfo(np.int64).min for p in tree_parent], dtype=np.int64)
+        self.tree_size = np.array(tree_size, dtype=np.int64)
+        self.tree_lo = np.array(lo, dtype=np.int64)
+        self.tree_hi = np.array(hi, dtype=np.int64)
+        self.leaf_order = np.array(leaf_order, dtype=np.int64)
+        self.leaf_position = np.empty(num_nodes, dtype=np.int64)
+        self.leaf_position[self.leaf_order] = np.arange(num_nodes)
+
+        # Ascending copies used to count nodes and merges above a threshold by binary search
+        self._sorted_activation = np.sort(activation[self._has_edges])
+        self._sorted_merge_weights = np.sort(self.tree_weight[num_nodes:])
+
+    def _count_at_least(self, sorted_values, min_weight):
+        return len(sorted_values) - np.searchsorted(sorted_values, min_weight, side='left')
+
+    def num_edges(self, min_weight) -> int:
+        """ Number of edges with a weight of at least min_weight. """
+        return int(self._count_at_least(self.weights[::-1], min_weight))
+
+    def num_components(self, min_weight) -> int:
+        """ Number of connected components once edges below min_weight are removed. """
+        nodes = self._count_at_least(self._sorted_activation, min_weight)
+        merges = self._count_at_least(self._sorted_merge_weights, min_weight)
+        return int(nodes - merges)
+
+    def components(self, min_weight) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Leaf ranges (lo, hi) and sizes of the components at min_weight, largest first. """
+        # Another thread (e.g. a concurrent dashboard callback) may clear the cache between the store and a
+        # read back, so the result is returned from the local variable
+        components = self._components_cache.get(min_weight)
+        if components is None:
+            is_component = (self.tree_weight >= min_weight) & (self.tree_parent_weight < min_weight)
+            is_component[:len(self.nodes)] &= self._has_edges
+            tree_nodes = np.flatnonzero(is_component)
+            tree_nodes = tree_nodes[np.argsort(-self.tree_size[tree_nodes], kind='stable')]
+            components = (self.tree_lo[tree_nodes], self.tree_hi[tree_nodes], self.tree_size[tree_nodes])
+            if len(self._components_cache) > 256:
+                self._components_cache.clear()
+            self._components_cache[min_weight] = components
+        return components
+
+    def top_components(self, min_weight, n_components=None) -> List[List[str]]:
+        """ Node labels of the n largest components at min_weight. """
+        lo, hi, _ = self.components(min_weight)
+        return [[self.nodes[i] for i in self.leaf_order[start:end].tolist()]
+                for start, end in zip(lo[:n_components].tolist(), hi[:n_components].tolist())]
+
+    def query(self, min_weight, n_components=None):
+        """
+        Returns the nodes, degrees and edges of the subgraph made of the n largest components once
+        edges below min_weight are removed.
+        :return: (node labels, degree of each node, list of (source, target, weight) edges)
+        """
+        num_edges = self.num_edges(min_weight)
+        sources = self.sources[:num_edges]
+        targets = self.targets[:num_edges]
+        weights = self.weights[:num_edges]
+
+        lo, hi, _ = self.components(min_weight)
+        if n_components is not None and n_components < len(lo):
+            lo, hi = lo[:n_components], hi[:n_components]
+            # Keep edges whose source falls inside one of the selected leaf ranges
+            order = np.argsort(lo)
+            lo, hi = lo[order], hi[order]
+            position = self.leaf_position[sources]
+            slot = np.searchsorted(lo, position, side='right') - 1
+            keep = (slot >= 0) & (position < hi[np.maximum(slot, 0)])
+            sources, targets, weights = sources[keep], targets[keep], weights[keep]
+
+        node_ids = np.concatenate([self.leaf_order[start:end] for start, end in zip(lo.tolist(), hi.tolist())]) \
+            if len(lo) else np.empty(0, dtype=np.int64)
+        degrees = np.bincount(sources, minlength=len(self.nodes)) + np.bincount(targets, minlength=len(self.nodes))
+
+        nodes = self.nodes
+        return (
+            [nodes[i] for i in node_ids.tolist()],
+            degrees[node_ids].tolist(),
+            [(nodes[u], nodes[v], weight) for u, v, weight in zip(sources.tolist(), targets.tolist(), weights.tolist())],
+        )
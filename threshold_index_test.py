@@ -0,0 +1,58 @@
+import random
+import networkx as nx
+import pytest
+from threshold_index import ThresholdIndex
+
+
+def _random_graph(seed, num_nodes=80, num_edges=160):
+    rng = random.Random(seed)
+    G = nx.gnm_random_graph(num_nodes, num_edges, seed=seed)
+    for u, v in G.edges():
+        G[u][v]['weight'] = rng.randint(1, 20)  # Small range so many edges share a weight
+    G.add_edge(0, 0, weight=15)  # Self-loop
+    G.add_node('isolated')
+    return nx.relabel_nodes(G, {node: f"word{node}" for node in G.nodes() if node != 'isolated'})
+
+
+def _thresholded(G, min_weight):
+    """ The subgraph the dashboard originally built: edges of at least min_weight and their endpoints. """
+    H = nx.Graph()
+    H.add_edges_from((u, v, data) for u, v, data in G.edges(data=True) if data['weight'] >= min_weight)
+    return H
+
+
+def _edge_set(edges):
+    return {(frozenset((u, v)), weight) for u, v, weight in edges}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_threshold_index_matches_networkx(seed):
+    G = _random_graph(seed)
+    index = ThresholdIndex.from_networkx(G)
+
+    for min_weight in range(0, 23):
+        H = _thresholded(G, min_weight)
+        components = [frozenset(component) for component in nx.connected_components(H)]
+
+        assert index.num_edges(min_weight) == H.number_of_edges()
+        assert index.num_components(min_weight) == len(components)
+        assert set(map(frozenset, index.top_components(min_weight))) == set(components)
+        assert index.components(min_weight)[2].tolist() == sorted(map(len, components), reverse=True)
+
+        for n_components in (None, 1, 3):
+            nodes, degrees, edges = index.query(min_weight, n_components)
+            expected_nodes = set().union(*index.top_components(min_weight, n_components))
+            sizes = sorted(map(len, components), reverse=True)[:n_components]
+            assert len(nodes) == len(set(nodes)) == len(expected_nodes) == sum(sizes)
+            assert set(nodes) == expected_nodes
+            assert dict(zip(nodes, degrees)) == dict(H.degree(nodes))
+            assert _edge_set(edges) == _edge_set(H.subgraph(nodes).edges(data='weight'))
+
+
+def test_round_trip_through_networkx():
+    G = _random_graph(seed=0)
+    index = ThresholdIndex.from_networkx(G)
+    G2 = index.to_networkx()
+    assert set(G2.nodes()) == set(G.nodes())
+    assert _edge_set(G2.edges(data='weight')) == _edge_set(G.edges(data='weight'))
+    assert dict(zip(index.nodes, index.degrees().tolist())) == dict(G.degree())
@@ -0,0 +1,198 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+COMPRESS_MIN_BYTES = 256  # Shorter token lists are stored uncompressed
+
+
+class TokenCache:
+    def __init__(self, path, namespace='', max_bytes=256 * 1024 * 1024, write_batch=256):
+        """
+        Persistent, content-addressed cache of tokenized texts backed by SQLite.
+        :param path: Database file, created on first use.
+        :param namespace: Tokenizer identity (version and settings) mixed into every key.
+        :param max_bytes: Size of stored tokens above which the least recently used entries are evicted.
+        :param write_batch: New entries and recency updates buffered in memory before they are written in
+            one transaction, so lookups and single puts don't write to the database.
+        """
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.write_batch = write_batch
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending: Dict[bytes, tuple] = {}  # key -> (data, compressed, size) not written yet
+        self._touched: Dict[bytes, int] = {}  # key -> last use of cached entries, not written yet
+        atexit.register(self.flush)
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # Connections and locks can't be pickled; both are recreated on first use.
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pending'] = {}
+        state['_touched'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "key BLOB PRIMARY KEY, data BLOB NOT NULL, compressed INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, last_used INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tokens_last_used ON tokens (last_used)")
+            # Size of all entries, kept in the database so every process sharing the file sees the same total
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO stats SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM tokens")
+        return self._conn
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.namespace}\0{text}".encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+    @staticmethod
+    def _encode(tokens):
+        data = ' '.join(tokens).encode()
+        if len(data) >= COMPRESS_MIN_BYTES:
+            return zlib.compress(data, 1), 1
+        return data, 0
+
+    @staticmethod
+    def _decode(data, compressed):
+        if compressed:
+            data = zlib.decompress(data)
+        return data.decode().split()
+
+    def get(self, text: str) -> Optional[List[str]]:
+        return self.get_many([text]).get(0)
+
+    def get_many(self, texts: List[str]) -> Dict[int, List[str]]:
+        """
+        Looks up many texts at once and returns the tokens of the cached ones by position. Lookups only
+        read; their recency is written with the next batch of writes.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for key in keys:
+                if key in self._pending:
+                    found[key] = self._pending[key][:2]
+            missing_keys = [key for key in keys if key not in found]
+            for start in range(0, len(missing_keys), 500):  # Stay below SQLite's bound variable limit
+                batch = missing_keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, data, compressed FROM tokens WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((key, (data, compressed)) for key, data, compressed in rows)
+            if found:
+                now = time.time_ns()  # Wall clock, so recency compares across processes
+                self._touched.update((key, now) for key in found if key not in self._pending)
+                if len(self._touched) >= self.write_batch:
+                    self._flush(conn)
+
+        result = {}
+        for i, key in enumerate(keys):
+            if key in found:
+                result[i] = self._decode(*found[key])
+        self.hits += len(result)
+        self.misses += len(texts) - len(result)
+        return result
+
+    def put(self, text: str, tokens: List[str]):
+        self.put_many([text], [tokens])
+
+    def put_many(self, texts: List[str], tokenized_texts: List[List[str]]):
+        """ Buffers tokenized texts, writing them once write_batch entries are pending. """
+        rows = {}
+        for text, tokens in zip(texts, tokenized_texts):
+            data, compressed = self._encode(tokens)
+            rows[self.key(text)] = (data, compressed, len(data))
+        with self._lock:
+            self._pending.update(rows)
+            if len(self._pending) >= self.write_batch:
+                self._flush(self._connect())
+
+    def flush(self):
+        """ Writes the buffered entries and recency updates. """
+        with self._lock:
+            if self._pending or self._touched:
+                self._flush(self._connect())
+
+    def _flush(self, conn):
+        """
+        Writes the buffered entries and recency updates in one transaction, then evicts the least recently
+        used entries when over max_bytes. The total size is read and updated inside the write transaction,
+        so it stays exact when several processes share the file.
+        """
+        pending, self._pending = self._pending, {}
+        touched, self._touched = self._touched, {}
+        now = time.time_ns()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            added_bytes = 0
+            for key, (data, compressed, size) in pending.items():
+                previous = conn.execute("SELECT size FROM tokens WHERE key = ?", (key,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?)", (key, data, compressed, size, now))
+                added_bytes += size - (previous[0] if previous else 0)
+            conn.executemany("UPDATE tokens SET last_used = ? WHERE key = ?", [(last_used, key) for key, last_used in touched.items()])
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'total_bytes'", (added_bytes,))
+            total_bytes = conn.execute("SELECT value FROM stats WHERE name = 'total_bytes'").fetchone()[0]
+            if total_bytes > self.max_bytes:
+                self._evict(conn, total_bytes)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn, total_bytes):
+        """ Removes the least recently used entries until the cache is back to 90% of max_bytes. """
+        target = self.max_bytes * 0.9
+        evicted_bytes = 0
+        while total_bytes - evicted_bytes > target:
+            rows = conn.execute("SELECT key, size FROM tokens ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                conn.execute("DELETE FROM tokens WHERE key = ?", (key,))
+                evicted_bytes += size
+                if total_bytes - evicted_bytes <= target:
+                    break
+        conn.execute("UPDATE stats SET value = value - ? WHERE name = 'total_bytes'", (evicted_bytes,))
+
+    def total_bytes(self) -> int:
+        """ Size of the stored tokens, shared by every process using the file. """
+        with self._lock:
+            return self._connect().execute("SELECT value FROM stats WHERE name = 'total_bytes'").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._touched.clear()
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM tokens")
+            conn.execute("UPDATE stats SET value = 0 WHERE name = 'total_bytes'")
+            conn.execute("COMMIT")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,143 @@
+import hashlib
+import re
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Iterable, List
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+
+# Bump whenever the cleaning rules below change, so cached tokens are invalidated.
+TOKENIZER_VERSION = 1
+
+DEFAULT_WORDS_TO_REMOVE = ('http', 'com', 'www')
+
+# The ten original substitutions collapse into three passes. Every pattern in a pass only
+# ever removes whole words, so removing one word never changes the boundaries another
+# pattern of the same pass sees. Non-ASCII removal does create new boundaries, which is
+# why it stays a pass of its own between the other two.
+_WORD_PATTERNS = re.compile(
+    r'\b(?:'
+    r'_+[a-z0-9]+'             # Patterns starting with underscore(s)
+    r'|\d+[a-z][a-z0-9_]*'     # Patterns like '003dl0nlraie1'
+    r'|[a-z0-9]+_[a-z0-9_]+'   # Patterns with underscores
+    r'|\d+s'                   # Patterns like '000s'
+    r')\b'
+)
+_NON_ASCII = re.compile(r'[^\x00-\x7F]+')
+_NUMBERS_AND_SYMBOLS = re.compile(
+    r'\b(?:[0-9a-f]+|_*\d+)\b'  # Hexadecimal numbers and numbers with optional leading underscores
+    r'|_\w*'                    # Words starting with underscore and stray underscores
+    r'|\W+'                     # Remaining special characters
+)
+
+
+class Tokenizer:
+    def __init__(self, stop_words: Iterable[str] = None, words_to_rem: Iterable[str] = DEFAULT_WORDS_TO_REMOVE,
+                 lemma_cache_size: int = 2 ** 16):
+        """
+        Compiled equivalent of the original CorpusManager.clean_and_tokenize.
+        :param stop_words: Words dropped before lemmatization (NLTK english stopwords by default).
+        :param words_to_rem: Extra words dropped alongside the stopwords.
+        :param lemma_cache_size: Maximum number of distinct words kept in the lemma cache.
+        """
+        if stop_words is None:
+            stop_words = stopwords.words("english")
+        self.stop_words = frozenset(stop_words) | frozenset(words_to_rem)
+        self.lemma_cache_size = lemma_cache_size
+        self.lemmatizer = WordNetLemmatizer()
+        self._build_cache()
+
+    def _build_cache(self):
+        self._word_tokens = lru_cache(maxsize=self.lemma_cache_size)(self._tokenize_word)
+
+    def __getstate__(self):
+        # lru_cache wrappers can't be pickled; the cache is rebuilt on load.
+        state = self.__dict__.copy()
+        del state['_word_tokens']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_cache()
+
+    def _tokenize_word(self, word):
+        # After cleaning, the text only holds [a-z0-9] words separated by spaces. The only rules
+        # word_tokenize still applies there are single-word contractions ("cannot", "gonna"), so
+        # tokenizing each word on its own gives the same tokens as tokenizing the whole text.
+        return tuple(self.lemmatizer.lemmatize(token) for token in word_tokenize(word)
+                     if token not in self.stop_words)
+
+    def clean(self, text: str) -> str:
+        """ Applies the cleaning rules and returns space separated words. """
+        text = _WORD_PATTERNS.sub(' ', text.lower())
+        text = _NON_ASCII.sub(' ', text)
+        return _NUMBERS_AND_SYMBOLS.sub(' ', text)
+
+    def tokenize(self, text: str) -> List[str]:
+        """ Cleans, tokenizes, removes stopwords and lemmatizes the given text. """
+        words = []
+        for word in self.clean(text).split():
+            words.extend(self._word_tokens(word))
+        return words
+
+    def fingerprint(self) -> str:
+        """ Identifies the tokenizer version and settings, so persisted tokens can be keyed by it. """
+        settings = hashlib.blake2b('\0'.join(sorted(self.stop_words)).encode(), digest_size=8).hexdigest()
+        return f"v{TOKENIZER_VERSION}-{settings}"
+
+    def cache_info(self):
+        return self._word_tokens.cache_info()
+
+
+# Per-process tokenizer, created once by the pool initializer
+_worker_tokenizer = None
+
+
+def _init_worker(stop_words, words_to_rem, lemma_cache_size):
+    global _worker_tokenizer
+    _worker_tokenizer = Tokenizer(stop_words, words_to_rem, lemma_cache_size)
+    _worker_tokenizer.lemmatizer.lemmatize('war')  # Load WordNet once per worker, not on the first chunk
+
+
+def _tokenize_chunk(texts):
+    return [_worker_tokenizer.tokenize(text) for text in texts]
+
+
+def tokenize_parallel(texts: List[str], tokenizer: Tokenizer, processes=None, chunksize=256) -> List[List[str]]:
+    """
+    Tokenizes texts across a process pool, preserving the input order.
+    :param texts: Texts to tokenize.
+    :param tokenizer: Tokenizer whose stopwords and cache size each worker copies.
+    :param processes: Number of worker processes (defaults to the number of CPUs).
+    :param chunksize: Number of texts sent to a worker at a time.
+    """
+    chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+    init_args = (tokenizer.stop_words, (), tokenizer.lemma_cache_size)
+    with Pool(processes, initializer=_init_worker, initargs=init_args) as pool:
+        tokenized_texts = []
+        for tokenized_chunk in pool.imap(_tokenize_chunk, chunks):  # imap yields chunks in submission order
+            tokenized_texts.extend(tokenized_chunk)
+    return tokenized_texts
+
+
+def reference_clean_and_tokenize(text, stop_words, words_to_rem=DEFAULT_WORDS_TO_REMOVE, lemmatizer=None):
+    """ The original, unoptimized implementation. Kept as the reference for parity checks. """
+    lemmatizer = lemmatizer or WordNetLemmatizer()
+    text = text.lower()
+
+    # Remove various alphanumeric patterns
+    text = re.sub(r'\b_+[a-z0-9]+\b', ' ', text)  # Remove patterns starting with underscore(s)
+    text = re.sub(r'\b\d+[a-z][a-z0-9_]*\b', ' ', text)  # Remove patterns like '003dl0nlraie1'
+    text = re.sub(r'\b[a-z0-9]+_[a-z0-9_]+\b', ' ', text)  # Remove patterns with underscores
+    text = re.sub(r'\b\d+s\b', ' ', text)  # Remove patterns like '000s'
+    text = re.sub(r'[^\x00-\x7F]+', ' ', text)  # Remove non-ASCII characters
+    text = re.sub(r'\b[0-9a-f]+\b', ' ', text)  # Remove hexadecimal numbers
+    text = re.sub(r'\b_*\d+\b', ' ', text)  # Remove numbers with optional leading underscores
+    text = re.sub(r'_\w+', ' ', text)  # Remove any word that starts with underscore
+    text = re.sub(r'_{1,}', ' ', text)  # Remove underscores (one or more)
+    text = re.sub(r'\W+', ' ', text)  # Remove remaining special characters
+
+    words = word_tokenize(text)
+    combined_words_to_remove = set(list(stop_words) + list(words_to_rem))
+    return [lemmatizer.lemmatize(word) for word in words if word not in combined_words_to_remove]
@@ -0,0 +1,36 @@
+import nltk
+import pytest
+from benchmarks import synthetic_texts
+from tokenizer import Tokenizer, reference_clean_and_tokenize
+
+NLTK_DATA = ('corpora/stopwords', 'corpora/wordnet', 'tokenizers/punkt_tab')
+
+# Texts hitting each cleaning rule, plus the contractions word_tokenize still splits after cleaning
+EDGE_CASE_TEXTS = [
+    "",
+    "Ukraine's army moved 300 tanks; the 1990s were different!",
+    "__init__ _private 003dl0nlraie1 snake_case_word deadbeef 0x1f _42 000s",
+    "Visit https://www.example.com/path?q=1 for more",
+    "Café Zürich naïve résumé — “quoted” ‘text’",
+    "I cannot believe they're gonna do it, wanna see? Don't!",
+    "MIXED case WORDS and punctuation... lots of it!!! (really) [yes] {no}",
+    "tabs\tand\nnew lines\r\nin   the    text",
+]
+
+
+@pytest.fixture(scope='module')
+def stop_words():
+    for resource in NLTK_DATA:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            pytest.skip(f"NLTK data {resource} is not installed")
+    return nltk.corpus.stopwords.words("english")
+
+
+@pytest.mark.parametrize('texts', [EDGE_CASE_TEXTS, synthetic_texts(num_texts=500, seed=7)], ids=['edge_cases', 'synthetic'])
+def test_tokenizer_matches_the_reference_implementation(stop_words, texts):
+    tokenizer = Tokenizer(stop_words)
+    for text in texts:
+        expected = reference_clean_and_tokenize(text, stop_words, lemmatizer=tokenizer.lemmatizer)
+        assert tokenizer.tokenize(text) == expected, text
@@ -1,61 +1,189 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
+from typing import Dict, List, Sequence, Tuple
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from bs4 import BeautifulSoup
 import numpy as np
 
+# Column order of score matrices, the key order of polarity_scores
+SCORE_KEYS = ("neg", "neu", "pos", "compound")
+
+def classify(compound) -> str:
+    return "Positive" if compound >= 0.5 else "Negative" if compound <= -0.5 else "Neutral"
+
+def _to_scores(row) -> Dict[str, float]:
+    return dict(zip(SCORE_KEYS, row.tolist()))
+
 class VaderSentimentAnalyzer:
-    def __init__(self, corpus_manager):
+    def __init__(self, corpus_manager, score_cache_size=2**16, tokenizer=None, processes=1, parallel_threshold=20000):
         """
         Initializes the VADER Sentiment Analyzer with shared data.
         :param corpus_manager: The shared CorpusManager instance.
+        :param score_cache_size: Number of cleaned texts whose scores are kept, so repeated bodies like
+            "[deleted]" are scored once.
+        :param tokenizer: Tokenizer used instead of the corpus manager's cached tokenization, e.g. in
+            worker processes. Defaults to the corpus manager's tokenizer.
+        :param processes: Worker processes scoring large batches of posts, None for one per CPU and 1 to
+            stay in-process.
+        :param parallel_threshold: Batches with fewer texts than this are always scored in-process.
         """
         self.corpus_manager = corpus_manager
+        self.tokenizer = tokenizer if tokenizer is not None else corpus_manager.tokenizer
         self.analyzer = SentimentIntensityAnalyzer()
+        self.score_cache_size = score_cache_size
+        self.processes = processes
+        self.parallel_threshold = parallel_threshold
+        self._score_cache: OrderedDict = OrderedDict()  # blake2b of cleaned text -> score row
+        self._lock = threading.Lock()
+
+    def score_texts(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Scores many texts, cleaning and scoring each distinct text only once.
+        :return: (len(texts), 4) matrix of scores, columns in SCORE_KEYS order.
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        if self.corpus_manager is not None:
+            tokenized_texts = self.corpus_manager.tokenize_texts(unique_texts)
+        else:
+            tokenized_texts = [self.tokenizer.tokenize(text) for text in unique_texts]
+        joined_texts = [' '.join(tokens) for tokens in tokenized_texts]
+        keys = [hashlib.blake2b(joined_text.encode('utf-8'), digest_size=16).digest() for joined_text in joined_texts]
+
+        rows = {}
+        with self._lock:
+            for key in keys:
+                row = self._score_cache.get(key)
+                if row is not None:
+                    self._score_cache.move_to_end(key)
+                    rows[key] = row
+
+        scored = {}
+        for key, joined_text in zip(keys, joined_texts):
+            if key not in rows and key not in scored:
+                sentiment_scores = self.analyzer.polarity_scores(joined_text)
+                scored[key] = tuple(sentiment_scores[score_key] for score_key in SCORE_KEYS)
+
+        if scored:
+            rows.update(scored)
+            with self._lock:
+                self._score_cache.update(scored)
+                while len(self._score_cache) > self.score_cache_size:
+                    self._score_cache.popitem(last=False)
+
+        unique_rows = dict(zip(unique_texts, (rows[key] for key in keys)))
+        return np.array([unique_rows[text] for text in texts], dtype=np.float64).reshape(len(texts), len(SCORE_KEYS))
 
     def analyze_sentiment(self, text):
         """ Analyzes sentiment of the given text. """
-        tokens = self.corpus_manager.clean_and_tokenize(text)
-        joined_text = ' '.join(tokens)
-        sentiment_scores = self.analyzer.polarity_scores(joined_text)
-        compound = sentiment_scores["compound"]
-        pos = sentiment_scores["pos"]
-        neu = sentiment_scores["neu"]
-        neg = sentiment_scores["neg"]
-        classifier = "Positive" if compound >= 0.5 else "Negative" if compound <= -0.5 else "Neutral"
-        return classifier, sentiment_scores
+        return self.analyze_sentiments([text])[0]
+
+    def analyze_sentiments(self, texts: Sequence[str]) -> List[Tuple[str, Dict[str, float]]]:
+        """ Analyzes the sentiment of many texts, returning (classifier, scores) for each. """
+        return [(classify(row[3]), _to_scores(row)) for row in self.score_texts(texts)]
 
     def analyze_overall_post_sentiment(self, text_post, comments, ratio=0.5):
         """ Creates a compound score for all the comments in a post. """
-        _, main_post_sentiment_scores = self.analyze_sentiment(text_post)
+        return self.analyze_overall_post_sentiments([(text_post, comments)], ratio=ratio)[0]
+
+    def analyze_overall_post_sentiments(self, posts: Sequence[Tuple[str, Sequence[str]]], ratio=0.5):
+        """
+        Creates the overall score of many posts at once, scoring the post texts and comments of the whole
+        batch together.
+        :param posts: (post text, comments) pairs.
+        :param ratio: Weight of the post text, the mean of the comments gets the rest.
+        :return: (classifier, scores) for each post.
+        """
+        return [overall for _, overall in self.analyze_posts(posts, ratio=ratio)]
+
+    def analyze_posts(self, posts: Sequence[Tuple[str, Sequence[str]]], ratio=0.5):
+        """
+        Scores the text of many posts and their overall sentiment with comments in one pass. Large batches
+        are spread across a process pool when processes isn't 1.
+        :param posts: (post text, comments) pairs.
+        :param ratio: Weight of the post text in the overall score.
+        :return: ((classifier, scores) of the post text, (classifier, scores) overall) for each post.
+        """
+        num_texts = sum(1 + len(comments) for _, comments in posts)
+        if self.processes != 1 and num_texts >= self.parallel_threshold:
+            return analyze_posts_parallel(posts, self.tokenizer, ratio=ratio, processes=self.processes,
+                                          score_cache_size=self.score_cache_size)
+
+        texts = []
+        offsets = [0]
+        for text_post, comments in posts:
+            texts.append(text_post)
+            texts.extend(comments)
+            offsets.append(len(texts))
+        scores = self.score_texts(texts)
+
+        results = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            main_post_sentiment_scores = scores[start]
+            comment_scores = scores[start + 1:end]
+            num_items = len(comment_scores)
+            main_post = (classify(main_post_sentiment_scores[3]), _to_scores(main_post_sentiment_scores))
 
-        comment_scores = []
-        for comment in comments:
-            _, scores = self.analyze_sentiment(comment)
-            comment_scores.append(scores)
+            if num_items == 0:
+                results.append((main_post, (main_post[0], dict(main_post[1]))))
+                continue
 
-        num_items = len(comment_scores)
+            # Rows of a C-contiguous matrix are summed one after the other, like the built-in sum
+            comments_mean = comment_scores.sum(axis=0) / num_items
+            overall = main_post_sentiment_scores * ratio + comments_mean * (1 - ratio)
+            results.append((main_post, (classify(overall[3]), _to_scores(overall))))
+        return results
 
-        if num_items == 0:
-            classifier = "Positive" if main_post_sentiment_scores["compound"] >= 0.5 else "Negative" if main_post_sentiment_scores["compound"] <= -0.5 else "Neutral"       
-            return classifier, main_post_sentiment_scores
 
-        comments_compound = sum(x["compound"] for x in comment_scores) / num_items
-        comments_pos = sum([x["pos"] for x in comment_scores]) / num_items
-        comments_neu = sum([x["neu"] for x in comment_scores]) / num_items
-        comments_neg = sum([x["neg"] for x in comment_scores]) / num_items
+def _init_worker(tokenizer, score_cache_size):
+    global _worker_analyzer
+    _worker_analyzer = VaderSentimentAnalyzer(None, score_cache_size, tokenizer=tokenizer)
+    tokenizer.lemmatizer.lemmatize('war')  # Load WordNet once per worker, not on the first chunk
 
-        overall_compound = main_post_sentiment_scores["compound"] * ratio + comments_compound * (1 - ratio)
-        overall_pos = main_post_sentiment_scores["pos"] * ratio + comments_pos * (1 - ratio)
-        overall_neu = main_post_sentiment_scores["neu"] * ratio + comments_neu * (1 - ratio)
-        overall_neg = main_post_sentiment_scores["neg"] * ratio + comments_neg * (1 - ratio)
 
-        classifier = "Positive" if overall_compound >= 0.5 else "Negative" if overall_compound <= -0.5 else "Neutral"       
-        return classifier, {
-            "neg": overall_neg,
-            "neu": overall_neu,
-            "pos": overall_pos,
-            "compound": overall_compound
-        }
+def _analyze_chunk(chunk):
+    posts, ratio = chunk
+    return _worker_analyzer.analyze_posts(posts, ratio=ratio)
 
 
+def analyze_posts_parallel(posts, tokenizer, ratio=0.5, processes=None, chunk_texts=2000, score_cache_size=2**16,
+                           progress_interval=5.0):
+    """
+    Scores posts across a process pool, preserving the input order. Each worker builds its own
+    SentimentIntensityAnalyzer and score cache once, and chunks keep every post with all of its comments.
+    :param posts: (post text, comments) pairs.
+    :param tokenizer: Tokenizer each worker copies.
+    :param ratio: Weight of the post text in the overall score.
+    :param processes: Number of worker processes (defaults to the number of CPUs).
+    :param chunk_texts: Texts (post texts and comments) sent to a worker at a time. A post with more
+        comments than this makes a chunk of its own.
+    :param progress_interval: Seconds between progress reports.
+    :return: Same as VaderSentimentAnalyzer.analyze_posts.
+    """
+    chunks = []
+    chunk, chunk_size = [], 0
+    for text_post, comments in posts:
+        chunk.append((text_post, comments))
+        chunk_size += 1 + len(comments)
+        if chunk_size >= chunk_texts:
+            chunks.append((chunk, ratio))
+            chunk, chunk_size = [], 0
+    if chunk:
+        chunks.append((chunk, ratio))
 
-       
\ No newline at end of file
+    num_texts = sum(1 + len(comments) for _, comments in posts)
+    results = []
+    texts_done = 0
+    start = last_report = time.perf_counter()
+    with Pool(processes, initializer=_init_worker, initargs=(tokenizer, score_cache_size)) as pool:
+        for (chunk, _), chunk_results in zip(chunks, pool.imap(_analyze_chunk, chunks)):  # imap keeps submission order
+            results.extend(chunk_results)
+            texts_done += sum(1 + len(comments) for _, comments in chunk)
+            now = time.perf_counter()
+            if now - last_report >= progress_interval or len(results) == len(posts):
+                last_report = now
+                print(f"📊 Sentiment: {len(results):,}/{len(posts):,} posts, {texts_done:,}/{num_texts:,} texts, "
+                      f"{texts_done / max(now - start, 1e-9):,.0f} texts/sec")
+    return results